@@ -24,9 +24,6 @@ cimport cython
 import numpy as np
 cimport numpy as np
 
-import matplotlib
-import matplotlib.pyplot as plt
-
 import scipy.fftpack as fftpack
 
 ctypedef np.float32_t F32_t
@@ -42,12 +39,19 @@ getlive = lambda offsets: [i for i in xrange(len(offsets)) if offsets[i] != 0]
 timereduce = lambda offsets, redvel, shift: [float(offset) / redvel + shift for offset in offsets]
 
 def getpicks (sf, header='delrt'):
-  picks = np.array([(float(trh[header]) if trh[header] < 60000 else 0.) for trh in sf.trhead])
+  picks = sf.readTraceHeaders([header], asdict=True)[header].astype(np.float64)
+  picks[picks >= 60000] = 0.
   return picks
 
 def calcoffset (sf, in3D=False):
-  norm = (calc3Doffset if in3D else calc2Doffset)
-  return np.array([norm(trh) for trh in sf.trhead])
+  trh = sf.readTraceHeaders(['sx', 'sy', 'gx', 'gy', 'selev', 'gelev', 'scalco', 'scalel'], asdict=True)
+  trh = dict((key, trh[key].astype(np.float64)) for key in trh)
+  scalco = np.where(trh['scalco'] < 0, -1./np.where(trh['scalco'] == 0, 1., trh['scalco']), trh['scalco'])
+  offsets = ((trh['gx'] - trh['sx'])**2 + (trh['gy'] - trh['sy'])**2) * scalco**2
+  if (in3D):
+    scalel = np.where(trh['scalel'] < 0, -1./np.where(trh['scalel'] == 0, 1., trh['scalel']), trh['scalel'])
+    offsets += ((trh['gelev'] - trh['selev']) * scalel)**2
+  return np.sqrt(offsets)
 
 def clipsign (value, clip):
   clipthese = abs(value) > clip
@@ -55,6 +59,9 @@ def clipsign (value, clip):
 
 def wiggle (traces,skipt=1,scale=1.,lwidth=.1,offsets=None,redvel=0.,tshift=0.,sampr=1.,clip=10.,color='black',fill=True,line=True, **kwargs):
 
+  # Imported here so that loading this module does not start matplotlib
+  import matplotlib.pyplot as plt
+
   ns = traces.shape[1]
   ntr = traces.shape[0]
   t = np.arange(ns)*sampr
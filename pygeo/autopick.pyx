@@ -30,7 +30,6 @@ from scipy.ndimage import median_filter as _mf
 #np.import_array()
 ctypedef np.float32_t F32_t
 
-import pyopencl as cl
 import struct
 import os
 import clfiles
@@ -147,6 +146,9 @@ def energyRatioCL (np.ndarray[F32_t, ndim=2] traces, Py_ssize_t windowsize=earwi
   strideW = traces.strides[1]
   jsize = strideL/4
 
+  # Imported here so that loading this module does not initialize OpenCL
+  import pyopencl as cl
+
   ctx = cl.create_some_context()
   queue = cl.CommandQueue(ctx)
   mf = cl.mem_flags
@@ -0,0 +1,106 @@
+
+// pygeo - a distribution of tools for managing geophysical data
+// Copyright (C) 2011, 2012 Brendan Smithyman
+
+
+// This file is part of pygeo.
+
+// pygeo is free software: you can redistribute it and/or modify
+// it under the terms of the GNU Lesser General Public License as
+// published by the Free Software Foundation, either version 3 of
+// the License, or (at your option) any later version.
+
+// pygeo is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU Lesser General Public License for more details.
+
+// You should have received a copy of the GNU Lesser General Public License
+// along with pygeo.  If not, see <http://www.gnu.org/licenses/>.
+// ----------------------------------------------------------------------
+
+/* copyRange - Copies length bytes, starting at offset in the file open on
+infd, to the current position of the file open on outfd, and advances that
+position.  Where the platform allows, the data never leave the kernel:
+copy_file_range (which may also share extents on filesystems that support
+it) is tried first, then sendfile.  Otherwise, or if neither applies to the
+two files, the data are copied through a buffer with pread and write.
+Returns the number of bytes copied, which is less than length only at the
+end of the input file, or -1 (with errno set) on an error. */
+
+#include "fastcopy.h"
+
+#include <stdlib.h>
+
+#if defined(__linux__)
+#include <sys/sendfile.h>
+#include <sys/syscall.h>
+#endif
+
+Py_ssize_t copyRange (	int outfd,
+			int infd,
+			Py_ssize_t offset,
+			Py_ssize_t length) {
+
+  Py_ssize_t done = 0;
+  Py_ssize_t count, written, chunk;
+  char *buffer;
+
+#if defined(__linux__) && defined(SYS_copy_file_range)
+  loff_t inoffset;
+
+  while (done < length) {
+    inoffset = offset + done;
+    count = syscall(SYS_copy_file_range, infd, &inoffset, outfd, NULL, (size_t) (length - done), 0);
+    if (count <= 0)
+      break;
+    done += count;
+  }
+
+  if (done == length)
+    return done;
+#endif
+
+#if defined(__linux__)
+  off_t sendoffset;
+
+  while (done < length) {
+    sendoffset = offset + done;
+    count = sendfile(outfd, infd, &sendoffset, (size_t) (length - done));
+    if (count <= 0)
+      break;
+    done += count;
+  }
+
+  if (done == length)
+    return done;
+#endif
+
+  buffer = malloc(COPY_BUFFER);
+  if (buffer == NULL)
+    return -1;
+
+  while (done < length) {
+    chunk = (length - done < COPY_BUFFER) ? (length - done) : COPY_BUFFER;
+    count = pread(infd, buffer, chunk, offset + done);
+    if (count < 0) {
+      free(buffer);
+      return -1;
+    }
+    if (count == 0)
+      break;
+
+    for (written = 0; written < count; ) {
+      chunk = write(outfd, buffer + written, count - written);
+      if (chunk < 0) {
+        free(buffer);
+        return -1;
+      }
+      written += chunk;
+    }
+    done += count;
+  }
+
+  free(buffer);
+  return done;
+}
@@ -0,0 +1,31 @@
+
+// pygeo - a distribution of tools for managing geophysical data
+// Copyright (C) 2011, 2012 Brendan Smithyman
+
+
+// This file is part of pygeo.
+
+// pygeo is free software: you can redistribute it and/or modify
+// it under the terms of the GNU Lesser General Public License as
+// published by the Free Software Foundation, either version 3 of
+// the License, or (at your option) any later version.
+
+// pygeo is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU Lesser General Public License for more details.
+
+// You should have received a copy of the GNU Lesser General Public License
+// along with pygeo.  If not, see <http://www.gnu.org/licenses/>.
+// ----------------------------------------------------------------------
+
+#include <Python.h>
+#include <sys/types.h>
+#include <unistd.h>
+
+#define COPY_BUFFER 1048576 /* bytes per read/write when copying in user space */
+
+Py_ssize_t copyRange (	int outfd,
+			int infd,
+			Py_ssize_t offset,
+			Py_ssize_t length);
@@ -117,6 +117,111 @@ fr = (fr >> 8) | (exp << 24) | (sgn << 31);
 }
 }
 
+/* Block conversion routines
+
+The functions below convert 2D blocks of samples (e.g., a strided view over
+the trace data in a memory-mapped SEG-Y file) in a single call.  Traces are
+distributed over OpenMP threads, and the per-sample conversion is written
+without data-dependent branches (the renormalization loops above are
+replaced by a count of leading zeros) so that it vectorizes well.  Results
+are identical to ibm2ieee / ieee2ibm.
+
+Strides are given in bytes; samples within a trace must be contiguous.  If
+parallel is zero, the block is converted on the calling thread only (e.g.,
+when the caller is already one of several worker threads). */
+
+#define OMP_MIN_BLOCK 65536 /* don't start threads for small blocks */
+
+static inline unsigned ibm2ieeeWord (unsigned ibm)
+{
+  unsigned sgn = ibm & 0x80000000u;
+  unsigned fr = ibm & 0x00ffffffu;
+  int lz = __builtin_clz(fr | 1u) - 8;
+  int exp = (int)((ibm >> 24) & 0x7f) * 4 - 130 - lz;
+  int sh = 1 - exp;
+  unsigned m = fr << lz;
+  unsigned normal, denormal, result;
+
+  sh = (sh > 31) ? 31 : sh;
+  sh = (sh < 0) ? 0 : sh;
+  normal = ((unsigned)exp << 23) | (m & 0x007fffffu);
+  denormal = m >> sh;
+
+  result = (exp > 0) ? normal : denormal;
+  result = (exp >= 255) ? 0x7f800000u : result;
+  result = fr ? result : 0u;
+
+  return result | sgn;
+}
+
+static inline unsigned ieee2ibmWord (unsigned ieee)
+{
+  unsigned sgn = ieee & 0x80000000u;
+  unsigned fr = ieee << 9;
+  int exp = (int)((ieee >> 23) & 0xff);
+  int k;
+  unsigned result;
+
+  fr = (exp > 0) ? ((fr >> 1) | 0x80000000u) : fr;
+  exp += 130;
+  fr >>= -exp & 3;
+  exp = (exp + 3) >> 2;
+
+  k = __builtin_clz(fr | 1u) >> 2;
+  fr <<= 4*k;
+  exp -= k;
+
+  result = (fr >> 8) | ((unsigned)exp << 24);
+  result = (((ieee >> 23) & 0xff) == 255) ? 0x7fffffffu : result;
+  result = (ieee & 0x7fffffffu) ? result : 0u;
+
+  return result | sgn;
+}
+
+void ibm2ieeeBlock (	float *outarr,
+			const char *inarr,
+			Py_ssize_t arrL,
+			Py_ssize_t arrW,
+			Py_ssize_t strideIn,
+			Py_ssize_t strideOut,
+			int parallel) {
+
+  Py_ssize_t i, j;
+  const unsigned *inrow;
+  unsigned *outrow;
+
+  #pragma omp parallel for private(i, j, inrow, outrow) if(parallel && arrL*arrW > OMP_MIN_BLOCK)
+  for (i = 0; i < arrL; i++) {
+    inrow = (const unsigned *)(inarr + i*strideIn);
+    outrow = (unsigned *)((char *)outarr + i*strideOut);
+
+    for (j = 0; j < arrW; j++)
+      outrow[j] = ibm2ieeeWord(ntohl(inrow[j]));
+  } // End parallel for over i
+}
+
+void ieee2ibmBlock (	char *outarr,
+			const float *inarr,
+			Py_ssize_t arrL,
+			Py_ssize_t arrW,
+			Py_ssize_t strideIn,
+			Py_ssize_t strideOut,
+			int parallel) {
+
+  Py_ssize_t i, j;
+  const unsigned *inrow;
+  unsigned *outrow;
+
+  #pragma omp parallel for private(i, j, inrow, outrow) if(parallel && arrL*arrW > OMP_MIN_BLOCK)
+  for (i = 0; i < arrL; i++) {
+    inrow = (const unsigned *)((const char *)inarr + i*strideIn);
+    outrow = (unsigned *)(outarr + i*strideOut);
+
+    for (j = 0; j < arrW; j++)
+      outrow[j] = htonl(ieee2ibmWord(inrow[j]));
+  } // End parallel for over i
+}
+
 /* Test harness for IEEE systems */
 #ifdef TEST
 #define MAX	1000000	 /* number of iterations */
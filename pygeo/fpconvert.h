@@ -4,3 +4,19 @@
 
 void ibm2ieee (void *to, const void *from, Py_ssize_t len);
 void ieee2ibm (void *to, const void *from, Py_ssize_t len);
+
+void ibm2ieeeBlock (	float *outarr,
+			const char *inarr,
+			Py_ssize_t arrL,
+			Py_ssize_t arrW,
+			Py_ssize_t strideIn,
+			Py_ssize_t strideOut,
+			int parallel);
+
+void ieee2ibmBlock (	char *outarr,
+			const float *inarr,
+			Py_ssize_t arrL,
+			Py_ssize_t arrW,
+			Py_ssize_t strideIn,
+			Py_ssize_t strideOut,
+			int parallel);
@@ -173,20 +173,27 @@ def importFrequencyPanels(globfn, sfopts=None):
     import os
     import re
     import numpy as np
-    from pygeo.segyread import SEGYFile
+    from pygeo.segyread import SEGYDataset
     
     matcher = re.compile('(?P<projnm>[^\.]+)\.(?P<field>(?:ut|vz|vx)[ifoOesrcbt]+)(?P<freq>[0-9]*\.?[0-9]+).*$')
     
-    def getGroupDict(fn):
+    files = glob.glob(globfn)
+    if not files:
+        return {}
+
+    # Panel files are opened through one dataset, which bounds the number
+    # of files held open at once
+    opts = {}
+    if sfopts is not None:
+        opts.update(sfopts)
+    ds = SEGYDataset(files, **opts)
 
-        if sfopts is not None:
-            sf = SEGYFile(fn, **sfopts)
-        else:
-            sf = SEGYFile(fn)
+    def getGroupDict(i):
 
-        fnbase = os.path.split(fn)[-1]
+        fnbase = os.path.split(ds.filenames[i])[-1]
         gd = matcher.match(fnbase).groupdict()
-        gd['data'] = sf[::2] + 1j * sf[1::2]
+        data = ds[ds.starts[i]:ds.starts[i+1], :ds.filens[i]]
+        gd['data'] = data[::2] + 1j * data[1::2]
         
         return gd
     
@@ -208,8 +215,7 @@ def importFrequencyPanels(globfn, sfopts=None):
         
         return hierDict
 
-    files = glob.glob(globfn)
-    
-    results = hierarchicalOrganization(map(getGroupDict, files))
+    results = hierarchicalOrganization(map(getGroupDict, range(len(files))))
+    ds.close()
     
     return results   
\ No newline at end of file
@@ -1,4 +1,3 @@
-
 # pygeo - a distribution of tools for managing geophysical data
 # Copyright (C) 2011, 2012 Brendan Smithyman
 
@@ -20,107 +19,246 @@
 # ----------------------------------------------------------------------
 
 import mmap
-import os
 import struct
+import sys
 import numpy as np
 
-BHEADLIST = ['jobid','lino','reno','ntrpr','nart','hdt','dto','hns','nso',
-             'format','fold','tsort','vscode','hsfs','hsfe','hslen','hstyp',
-             'schn','hstas','hstae','htatyp','hcorr','bgrcv','rcvm','mfeet',
-             'polyt','vpol']
+from pygeo.segyread import TRHEADDICT, FORMATDTYPES, SEGYFile, SEGYFileException, ibm2ieeeBlock, _traceHeaderDtype
 
-TRHEADLIST = ['tracl','tracr','fldr','tracf','ep','cdp','cdpt','trid','nvs',
-             'nhs','duse','offset','gelev','selev','sdepth','gdel','sdel',
-             'swdep','gwdep','scalel','scalco','sx','sy','gx','gy','counit',
-             'wevel','swevel','sut','gut','sstat','gstat','tstat','laga',
-             'lagb','delrt','muts','mute','ns','dt','gain','igc','igi','corr',
-             'sfs','sfe','slen','styp','stas','stae','tatyp','afilf','afils',
-             'nofilf','nofils','lcf','hcf','lcs','hcs','year','day','hour','minute','sec',
-             'timbas','trwf','grnors','grnofr','grnlof','gaps','otrav']
+# Maps the endian names used by SEGYFile to NumPy byte-order characters
+ENDIANORDER = {
+    'Big': '>',
+    'Little': '<',
+    'Native': '<' if (sys.byteorder == 'little') else '>',
+    'Foreign': '>' if (sys.byteorder == 'little') else '<',
+}
 
-STRUCT_TRHEAD = '<7L4H8L2H4L46H'
-STRUCT_BHEAD = '<3L24H'
+# ----------------------------------------------------------------------
 
+def ibm2ieee (raw, out=None):
+  '''
+  Converts IBM floating point words to native-endian IEEE float32, element
+  by element in the manner of a ufunc: *raw* may have any shape, strides
+  and byte order.  The words are gathered into a contiguous big-endian
+  block and converted by :py:func:`pygeo.segyread.ibm2ieeeBlock`.
 
-class SEGYArray (np.ndarray):
-  '''SEG-Y Array'''
+  :param raw: Array of 4-byte IBM floating point words.
+  :type raw: ndarray
+  :param out: Optional output array with the same shape.
+  :type out: ndarray, None
 
-  fm = None
-  bhead = None
-  thead = None
-  
-  def __new__ (cls, filename):
-    filesize = os.path.getsize(filename)
+  :returns: ndarray -- float32 array with the same shape as *raw*
+  '''
 
-    fp = open(filename, 'r+b')
-    fm = mmap.mmap(fp.fileno(), 0)
-    fp.close()
+  raw = np.asarray(raw)
 
-    trhead = fm[3600:3840]
-    ns = struct.unpack(STRUCT_TRHEAD, trhead[:180])[38]
-    
-    shape = ((filesize - 3600) / (240 + 4*ns),60+ns)
+  if (raw.size == 0):
+    result = np.zeros(raw.shape, dtype=np.float32)
+  else:
+    words = np.ascontiguousarray(raw, dtype='>u4').reshape((-1, raw.shape[-1] if raw.ndim else 1))
+    result = ibm2ieeeBlock(words).reshape(raw.shape)
 
-    self = np.ndarray.__new__(cls, dtype=np.float32, shape=shape, buffer=fm, offset=3600)
+  if (out is not None):
+    out[...] = result
+    return out
 
-    self = self[:,60:]
-    self.fm = fm
-    self.thead = fm[:3200].replace(' ','\x25').decode('IBM500')
-    tbh = struct.unpack(STRUCT_BHEAD, fm[3200:3260])
-    self.bhead = {}
-    for i, label in enumerate(BHEADLIST):
-      self.bhead[label] = tbh[i]
+  return result
 
-    return self
+class IBMTraces (object):
+  '''
+  Lazily converted view of IBM floating point trace data.  Indexing returns
+  native-endian float32 copies of the selected samples only; the underlying
+  words are not converted until they are requested.
 
-  def get_trhead(self, trace):
-    '''Gets trace headers for a zero-based trace number.'''
+  :param raw: Strided array of IBM floating point words (e.g., over a memory map).
+  :type raw: ndarray
+
+  :returns: :py:class:`IBMTraces` instance
+  '''
+
+  dtype = np.dtype(np.float32)
+
+  def __init__ (self, raw):
+    self.raw = raw
+
+  @property
+  def shape (self):
+    return self.raw.shape
+
+  @property
+  def ndim (self):
+    return self.raw.ndim
 
-    offset = 3600 + trace*self.strides[0]
-    tth = struct.unpack(STRUCT_TRHEAD,self.fm[offset:offset+180])
-    traceheaders = {}
-    for i, label in enumerate(TRHEADLIST):
-      traceheaders[label] = tth[i]
+  def __len__ (self):
+    return len(self.raw)
 
-    return traceheaders
+  def __getitem__ (self, index):
+    return ibm2ieee(self.raw[index])
 
-class SUArray (np.ndarray):
-  '''SU Array'''
+  def __array__ (self, dtype=None):
+    result = ibm2ieee(self.raw)
+    if (dtype is not None):
+      result = result.astype(dtype)
+    return result
+
+# ----------------------------------------------------------------------
+
+class SEGYArray (np.ndarray):
+  '''
+  SEG-Y Array: a zero-copy view of the traces in a memory-mapped SEG-Y file,
+  as a 1D array of records (the trace header fields followed by the samples)
+  in the byte order of the file.  Slicing returns another
+  :py:class:`SEGYArray` over the same memory map.
+
+  :param filename: The system path of the SEG-Y file to open.
+  :type filename: str
+  :param endian: Byte order of the trace data [Big,Little,Native,Foreign], as for :py:class:`pygeo.segyread.SEGYFile`.  Optional; SEG-Y rev2 files give the byte order in the binary header, and other files are taken to be big-endian.
+  :type endian: str, None
+  :param writable: Maps the file for writing, so that changes to the array are written to the file.  Default False.
+  :type writable: bool
+
+  :returns: :py:class:`SEGYArray` instance
+
+  :var headers: *ndarray* -- structured view of the trace header fields (one record per trace), strided over the samples.
+  :var data: *ndarray* -- (ntr, ns) view of the samples, strided over the trace headers; an :py:class:`IBMTraces` view for IBM floating point data.
+  :var thead: *str* -- ASCII translation of the text header.
+  :var bhead: *dict* -- binary header values (see :py:attr:`pygeo.segyread.SEGYFile.bhead`).
+  :var ns: *int* -- number of samples in each trace.
+  :var format: *int* -- trace format code.
+  '''
 
   fm = None
   bhead = None
   thead = None
-  
-  def __new__ (cls, filename):
-    filesize = os.path.getsize(filename)
+  ns = 0
+  format = 5
+  trheaddtype = None
+
+  def __new__ (cls, filename, endian=None, writable=False):
+    fp = open(filename, 'r+b' if writable else 'rb')
+    try:
+      fm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    finally:
+      fp.close()
+
+    layout = cls._readLayout(filename, fm, endian)
+
+    if (layout['format'] == 1):
+      sampledtype = np.dtype(layout['order'] + 'u4')
+    elif (layout['format'] in FORMATDTYPES):
+      sampledtype = np.dtype(layout['order'] + FORMATDTYPES[layout['format']][0])
+    else:
+      raise SEGYFileException('SEGYArray does not support trace format %d.'%(layout['format'],))
+
+    trheaddtype = layout['trheaddtype']
+    fields = trheaddtype.fields
+    recdtype = np.dtype({'names': list(trheaddtype.names) + ['data'],
+                         'formats': [fields[name][0] for name in trheaddtype.names] + [(sampledtype, (layout['ns'],))],
+                         'offsets': [fields[name][1] for name in trheaddtype.names] + [240],
+                         'itemsize': 240 + layout['ns']*sampledtype.itemsize})
+
+    self = np.ndarray.__new__(cls, shape=(layout['ntr'],), dtype=recdtype, buffer=fm, offset=layout['offset'])
 
-    fp = open(filename, 'r+b')
-    fm = mmap.mmap(fp.fileno(), 0)
-    fp.close()
+    self.fm = fm
+    self.thead = layout['thead']
+    self.bhead = layout['bhead']
+    self.ns = layout['ns']
+    self.format = layout['format']
+    self.trheaddtype = trheaddtype
 
-    trhead = fm[:240]
-    ns = struct.unpack(STRUCT_TRHEAD, trhead[:180])[38]
-    
-    shape = (filesize / (240 + 4*ns),60+ns)
+    return self
 
-    self = np.ndarray.__new__(cls, dtype=np.float32, shape=shape, buffer=fm)
+  @classmethod
+  def _readLayout (cls, filename, fm, endian):
+    '''
+    Reads the file headers, and returns the layout of the traces.
+    '''
 
-    self = self[:,60:]
-    self.fm = fm
+    with SEGYFile(filename, endian=endian, usemmap=False, lazy=True) as sf:
+      if (sf.traceoffsets is not None):
+        raise SEGYFileException('SEGYArray requires traces with the same number of samples.')
 
-    self.thead = None
-    self.bhead = None
+      return {'offset': sf.dataoffset, 'ntr': sf.ntr, 'ns': sf.ns,
+              'format': sf.bhead['format'], 'order': sf._dataByteOrder(),
+              'trheaddtype': sf.trheaddtype, 'thead': sf.thead, 'bhead': sf.bhead}
 
-    return self
+  def __array_finalize__ (self, obj):
+    if (obj is None):
+      return
 
-  def get_trhead(self, trace):
-    '''Gets trace headers for a zero-based trace number.'''
+    self.fm = getattr(obj, 'fm', None)
+    self.thead = getattr(obj, 'thead', None)
+    self.bhead = getattr(obj, 'bhead', None)
+    self.ns = getattr(obj, 'ns', 0)
+    self.format = getattr(obj, 'format', 5)
+    self.trheaddtype = getattr(obj, 'trheaddtype', None)
+
+  @property
+  def headers (self):
+    fields = self.trheaddtype.fields
+    dtype = np.dtype({'names': list(self.trheaddtype.names),
+                      'formats': [fields[name][0] for name in self.trheaddtype.names],
+                      'offsets': [fields[name][1] for name in self.trheaddtype.names],
+                      'itemsize': self.dtype.itemsize})
+
+    return self.view(np.ndarray).view(dtype)
 
-    offset = trace*self.strides[0]
-    tth = struct.unpack(STRUCT_TRHEAD,self.fm[offset:offset+180])
-    traceheaders = {}
-    for i, label in enumerate(TRHEADLIST):
-      traceheaders[label] = tth[i]
+  @property
+  def data (self):
+    raw = self.view(np.ndarray)['data']
 
-    return traceheaders
+    if (self.format == 1):
+      return IBMTraces(raw)
+
+    return raw
+
+  def get_trhead (self, trace):
+    '''Gets trace headers for a zero-based trace number.'''
 
+    row = self.headers[trace]
+
+    return dict((name, row[name].item()) for name in self.trheaddtype.names)
+
+class SUArray (SEGYArray):
+  '''
+  SU Array: as :py:class:`SEGYArray`, for a Seismic Unix variant file with
+  no text or binary header and IEEE floating point samples.  SU files are
+  written in the byte order of the machine that made them; unless *endian*
+  is given, the byte order is the one for which the ns header of the first
+  trace accounts for the size of the file (big-endian if both do).
+
+  :param filename: The system path of the SU file to open.
+  :type filename: str
+  :param endian: Byte order of the headers and data [Big,Little,Native,Foreign].  Optional.
+  :type endian: str, None
+  :param writable: Maps the file for writing.  Default False.
+  :type writable: bool
+
+  :returns: :py:class:`SUArray` instance
+  '''
+
+  @classmethod
+  def _readLayout (cls, filename, fm, endian):
+    '''
+    Reads the ns header of the first trace, and returns the layout of the
+    traces.
+    '''
+
+    filesize = len(fm)
+
+    if (endian is not None):
+      order = ENDIANORDER[endian]
+    else:
+      order = '>'
+      for candidate in ('>', '<'):
+        ns = struct.unpack(candidate + 'H', fm[114:116])[0]
+        if (ns > 0 and filesize % (240 + 4*ns) == 0):
+          order = candidate
+          break
+
+    ns = struct.unpack(order + 'H', fm[114:116])[0]
+
+    return {'offset': 0, 'ntr': filesize // (240 + 4*ns), 'ns': ns,
+            'format': 5, 'order': order,
+            'trheaddtype': _traceHeaderDtype(TRHEADDICT).newbyteorder(order),
+            'thead': None, 'bhead': None}
@@ -26,14 +26,43 @@ import struct
 import sys
 import copy
 import warnings
+import threading
+import Queue
+import collections
+import contextlib
+import tempfile
+import glob
 
 import numpy as np
 cimport numpy as np
 import cython 
 cimport cython
+from posix.mman cimport posix_madvise, POSIX_MADV_WILLNEED
+from posix.unistd cimport pread, pwrite
+from libc.string cimport memcpy, memset
+
+ctypedef np.float32_t F32_t
 
 MEGABYTE = 1048576
 
+# Number of traces packed per write by SEGYFile.writeSEGY / writeSU
+WRITEBLOCK = 4096
+
+# Number of randomly-chosen traces read by SEGYFile to autodetect the endian
+ENDIANSAMPLE = 32
+
+# Smallest bulk read (in samples) that is split over worker threads, and the
+# number of pieces per worker that it is split into
+PARALLELMIN = 262144
+PARALLELSPLIT = 4
+
+# Largest request (in traces) that SEGYFile reads through its cache; larger
+# requests, slices and streaming reads bypass it
+CACHEMAXTRACES = 64
+
+# Number of datafiles that SEGYDataset keeps open (memory-mapped) at once
+DATASETMAXOPEN = 64
+
 
 BHEADLIST = ['jobid','lino','reno','ntrpr','nart','hdt','dto','hns','nso',
              'format','fold','tsort','vscode','hsfs','hsfe','hslen','hstyp',
@@ -129,39 +158,412 @@ TRHEADDICT = {
 
 BHEADSTRUCT = '>3L24H'
 
+# SEG-Y rev2 binary header fields (bytes 3261-3532), unpacked in the byte
+# order given by the 'byteorder' word (without an order prefix here)
+BHEADREV2LIST = ['extntrpr','extnart','extns','extdt','extdto','extnso',
+                 'extfold','byteorder','revmajor','revminor','trflag',
+                 'ntexthead','ntrhead','htimbas','ntrfile','firsttrace',
+                 'ntrailer']
+
+BHEADREV2STRUCT = '3l2d2lL200x2B2hlh2Ql'
+
+# Value of the rev2 byte-order word, as read in the byte order of the file
+BYTEORDERWORD = 0x01020304
+
+# Sample formats that map directly onto NumPy types: FORMAT code -> (type
+# code without byte order, description); IBM floating point (1), fixed point
+# with gain (4) and the 24-bit integers (7, 15) are converted separately
+FORMATDTYPES = {
+    2: ('i4', '32-bit fixed point'),
+    3: ('i2', '16-bit fixed point'),
+    5: ('f4', 'IEEE floating point'),
+    6: ('f8', 'IEEE double precision floating point'),
+    8: ('i1', '8-bit fixed point'),
+    9: ('i8', '64-bit fixed point'),
+   10: ('u4', '32-bit unsigned fixed point'),
+   11: ('u2', '16-bit unsigned fixed point'),
+   12: ('u8', '64-bit unsigned fixed point'),
+   16: ('u1', '8-bit unsigned fixed point'),
+}
+
+# Marks the last extended textual header record, if their number is variable
+ENDTEXTSTANZA = '((SEG: EndText))'
+
+# Maps struct format codes (standard sizes) to NumPy type codes
+STRUCT2NUMPY = {
+    'b': 'i1', 'B': 'u1',
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4',
+    'l': 'i4', 'L': 'u4',
+    'q': 'i8', 'Q': 'u8',
+    'f': 'f4', 'd': 'f8',
+}
+
 MAJORHEADERS = [1,2,3,4,7,38,39]
 
 # ------------------------------------------------------------------------
 # Functions
 
-cdef extern from "Python.h":
-    char *PyString_AsString(object)
+cdef extern void c_ibm2ieeeBlock "ibm2ieeeBlock" (F32_t *outarr, char *inarr, Py_ssize_t arrL, Py_ssize_t arrW, Py_ssize_t strideIn, Py_ssize_t strideOut, int parallel) nogil
+
+def ibm2ieeeBlock (np.ndarray inarr, np.ndarray[F32_t, ndim=2] outarr=None, bint parallel=True):
+  '''
+  ibm2ieeeBlock(inarr, outarr=None, parallel=True) -> array
+
+  Converts a 2D block of big-endian IBM floating point words (e.g., a strided
+  view over the trace data in the memory map) to native-endian IEEE float32.
+  Traces are converted in parallel, with the GIL released.
+
+  :param inarr: 2D array of 4-byte words; samples in each trace must be contiguous.
+  :type inarr: ndarray
+  :param outarr: Optional preallocated output array with the same shape.
+  :type outarr: ndarray, None
+  :param parallel: Controls whether large blocks are split over OpenMP threads.
+  :type parallel: bool
+
+  :returns: ndarray -- 2D float32 array
+  '''
+
+  if (inarr.ndim != 2 or inarr.itemsize != 4 or (inarr.shape[1] > 1 and inarr.strides[1] != 4)):
+    raise SEGYFileException('IBM conversion requires a 2D array of 4-byte words with contiguous samples.')
+
+  if (outarr is None):
+    outarr = np.empty((inarr.shape[0], inarr.shape[1]), dtype=np.float32)
+  elif (outarr.shape[0] != inarr.shape[0] or outarr.shape[1] != inarr.shape[1] or (outarr.shape[1] > 1 and outarr.strides[1] != 4)):
+    raise SEGYFileException('Output array does not match input array.')
+
+  cdef char *inptr = <char *> inarr.data
+  cdef F32_t *outptr = <F32_t *> outarr.data
+  cdef Py_ssize_t arrL = inarr.shape[0]
+  cdef Py_ssize_t arrW = inarr.shape[1]
+  cdef Py_ssize_t strideIn = inarr.strides[0]
+  cdef Py_ssize_t strideOut = outarr.strides[0]
+
+  with nogil:
+    c_ibm2ieeeBlock(outptr, inptr, arrL, arrW, strideIn, strideOut, parallel)
+
+  return outarr
+
+cdef extern void c_ieee2ibmBlock "ieee2ibmBlock" (char *outarr, F32_t *inarr, Py_ssize_t arrL, Py_ssize_t arrW, Py_ssize_t strideIn, Py_ssize_t strideOut, int parallel) nogil
+
+def ieee2ibmBlock (inarr, np.ndarray outarr=None, bint parallel=True):
+  '''
+  ieee2ibmBlock(inarr, outarr=None, parallel=True) -> array
+
+  Converts a 2D block of IEEE floating point samples to big-endian IBM
+  floating point words, for writing.  Traces are converted in parallel,
+  with the GIL released.
+
+  :param inarr: 2D array of samples; converted to native float32 if necessary.
+  :type inarr: ndarray
+  :param outarr: Optional preallocated output array of 4-byte words with the same shape.
+  :type outarr: ndarray, None
+  :param parallel: Controls whether large blocks are split over OpenMP threads.
+  :type parallel: bool
+
+  :returns: ndarray -- 2D '>u4' array of IBM words
+  '''
+
+  cdef np.ndarray[F32_t, ndim=2] source = np.require(np.atleast_2d(inarr), dtype=np.float32, requirements='C')
+
+  if (outarr is None):
+    outarr = np.empty((source.shape[0], source.shape[1]), dtype='>u4')
+  elif (outarr.ndim != 2 or outarr.itemsize != 4 or outarr.shape[0] != source.shape[0] or outarr.shape[1] != source.shape[1] or (outarr.shape[1] > 1 and outarr.strides[1] != 4)):
+    raise SEGYFileException('Output array does not match input array.')
+
+  cdef char *outptr = <char *> outarr.data
+  cdef F32_t *inptr = <F32_t *> source.data
+  cdef Py_ssize_t arrL = source.shape[0]
+  cdef Py_ssize_t arrW = source.shape[1]
+  cdef Py_ssize_t strideIn = source.strides[0]
+  cdef Py_ssize_t strideOut = outarr.strides[0]
+
+  with nogil:
+    c_ieee2ibmBlock(outptr, inptr, arrL, arrW, strideIn, strideOut, parallel)
+
+  return outarr
+
+def _pread (int fd, Py_ssize_t length, Py_ssize_t offset):
+  '''
+  Reads a byte range from a file descriptor without using (or moving) the
+  shared file position, so that concurrent reads do not interfere.
+  '''
+
+  cdef np.ndarray buf = np.empty((length,), dtype=np.uint8)
+  cdef char *ptr = <char *> buf.data
+  cdef Py_ssize_t done = 0
+  cdef Py_ssize_t count = 0
+
+  while (done < length):
+    with nogil:
+      count = pread(fd, ptr + done, length - done, offset + done)
+    if (count < 0):
+      raise IOError('Read failed at byte offset %d.'%(offset + done,))
+    if (count == 0):
+      break
+    done += count
+
+  return buf[:done].tostring()
+
+def _pwrite (int fd, bytes data, Py_ssize_t offset):
+  '''
+  Writes a byte string to a file descriptor at a given offset, without using
+  (or moving) the shared file position.
+  '''
+
+  cdef char *ptr = data
+  cdef Py_ssize_t length = len(data)
+  cdef Py_ssize_t done = 0
+  cdef Py_ssize_t count = 0
+
+  while (done < length):
+    with nogil:
+      count = pwrite(fd, ptr + done, length - done, offset + done)
+    if (count <= 0):
+      raise IOError('Write failed at byte offset %d.'%(offset + done,))
+    done += count
+
+cdef extern Py_ssize_t c_copyRange "copyRange" (int outfd, int infd, Py_ssize_t offset, Py_ssize_t length) nogil
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _copyRuns (int outfd, int infd, np.ndarray[np.int64_t, ndim=1] offsets, np.ndarray[np.int64_t, ndim=1] lengths):
+  '''
+  Appends byte ranges of one file to another, at the current position of
+  *outfd*, in order (see copyRange in fastcopy.c).  The GIL is released
+  while copying.
+  '''
+
+  cdef Py_ssize_t nruns = offsets.shape[0]
+  cdef Py_ssize_t i
+  cdef Py_ssize_t failed = -1
+
+  with nogil:
+    for i in range(nruns):
+      if (c_copyRange(outfd, infd, offsets[i], lengths[i]) != lengths[i]):
+        failed = i
+        break
+
+  if (failed >= 0):
+    raise IOError('Copy failed at byte offset %d.'%(offsets[failed],))
+
+def _adviseWillNeed (np.ndarray mapped, Py_ssize_t offset, Py_ssize_t length):
+  '''
+  Advises the kernel that a byte range of a memory-mapped file (given as a
+  uint8 array over the whole map) will be needed soon, so that it can be
+  read ahead asynchronously.
+  '''
+
+  cdef Py_ssize_t start = offset - offset % mmap.PAGESIZE
+  cdef char *base = <char *> mapped.data
+
+  if (length <= 0 or start >= mapped.shape[0]):
+    return
+
+  length = min(length + offset - start, mapped.shape[0] - start)
+
+  with nogil:
+    posix_madvise(base + start, length, POSIX_MADV_WILLNEED)
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _scanTraceOffsets (source, Py_ssize_t first, Py_ssize_t filesize, Py_ssize_t samplen, bint little=False):
+  '''
+  Scans a file with variable-length traces in one pass, following the ns
+  header of each trace (little-endian if *little*), and returns the byte
+  offsets of the trace headers as an int64 array, followed by the offset of
+  the end of the last complete trace.  *source* is the memory map (as a uint8 array over
+  the whole map), or a file descriptor.
+  '''
+
+  cdef unsigned char *mapped = NULL
+  cdef int fd = -1
+  cdef np.ndarray mappedarr
+  cdef unsigned char word[2]
+  cdef Py_ssize_t pos = first
+  cdef Py_ssize_t ntraces = 0
+  cdef Py_ssize_t reclen
+  cdef int hi = 1 if little else 0
+
+  if isinstance(source, np.ndarray):
+    mappedarr = source
+    mapped = <unsigned char *> mappedarr.data
+  else:
+    fd = source
+
+  cdef np.ndarray[np.int64_t, ndim=1] offsets = np.empty((1024,), dtype=np.int64)
+
+  while (pos + 240 <= filesize):
+    if (mapped != NULL):
+      reclen = 240 + ((mapped[pos+114+hi] << 8) | mapped[pos+115-hi])*samplen
+    else:
+      if (pread(fd, word, 2, pos+114) != 2):
+        raise IOError('Read failed at byte offset %d.'%(pos+114,))
+      reclen = 240 + ((word[hi] << 8) | word[1-hi])*samplen
+
+    if (pos + reclen > filesize):
+      break
+
+    if (ntraces + 1 >= offsets.shape[0]):
+      offsets = np.resize(offsets, 2*offsets.shape[0])
+
+    offsets[ntraces] = pos
+    ntraces += 1
+    pos += reclen
+
+  offsets[ntraces] = pos
+
+  return offsets[:ntraces+1].copy()
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _gatherBytes (source, np.ndarray[np.int64_t, ndim=1] starts, np.ndarray[np.int64_t, ndim=1] lengths, np.ndarray[np.uint8_t, ndim=2] out):
+  '''
+  Copies a byte range from the file for each row of a 2D uint8 array (e.g.,
+  the samples of traces with different lengths), zero-padding the rest of
+  each row.  *source* is the memory map (as a uint8 array over the whole
+  map), or a file descriptor.  The GIL is released while copying.
+  '''
+
+  cdef unsigned char *mapped = NULL
+  cdef int fd = -1
+  cdef np.ndarray mappedarr
+  cdef unsigned char *base = <unsigned char *> out.data
+  cdef Py_ssize_t stride = out.strides[0]
+  cdef Py_ssize_t width = out.shape[1]
+  cdef Py_ssize_t nrows = starts.shape[0]
+  cdef Py_ssize_t i, length, count, done
+  cdef Py_ssize_t failed = -1
+
+  if isinstance(source, np.ndarray):
+    mappedarr = source
+    mapped = <unsigned char *> mappedarr.data
+  else:
+    fd = source
+
+  with nogil:
+    for i in range(nrows):
+      length = lengths[i] if lengths[i] < width else width
+      if (length < 0):
+        length = 0
+
+      if (mapped != NULL):
+        memcpy(base + i*stride, mapped + starts[i], length)
+      else:
+        done = 0
+        while (done < length):
+          count = pread(fd, base + i*stride + done, length - done, starts[i] + done)
+          if (count <= 0):
+            break
+          done += count
+        if (done < length):
+          failed = starts[i]
+          break
+
+      memset(base + i*stride + length, 0, width - length)
+
+  if (failed >= 0):
+    raise IOError('Read failed at byte offset %d.'%(failed,))
+
+  return out
+
+def _traceHeaderDtype (localdict):
+  '''
+  Builds a big-endian structured dtype for one 240-byte trace header from a
+  dictionary that maps byte offsets to [struct code, name] (see TRHEADDICT).
+  '''
+
+  names = []
+  formats = []
+  offsets = []
+
+  for key in sorted(localdict.keys()):
+    code, name = localdict[key]
+    if (code[-1] == 's'):
+      formats.append('S%d'%(struct.calcsize(code),))
+    else:
+      formats.append('>' + STRUCT2NUMPY[code])
+    names.append(name)
+    offsets.append(key)
+
+  return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': 240})
+
+def _fieldOverflow (fieldtype, values):
+  '''
+  Returns the (min, max) limits of an integer header field if any of the
+  values are outside them (i.e., would wrap when packed); otherwise None.
+  '''
+
+  values = np.asarray(values)
+  if (values.size == 0 or fieldtype.kind not in 'iu'):
+    return None
+
+  limits = np.iinfo(fieldtype)
+  if (values.min() < limits.min or values.max() > limits.max):
+    return limits.min, limits.max
 
-cdef extern void c_ibm2ieee "ibm2ieee" (char *outarr, char *inarr, Py_ssize_t len)
+  return None
 
-cdef ibm2ieee (str trace):
+def _queryHeaders (source, sort, group, predicates):
+  '''
+  Selects, sorts and groups traces by their header columns, for
+  :py:meth:`SEGYFile.query` and :py:meth:`SEGYDataset.query`.  *source*
+  provides readTraceHeaders and ntr.
+  '''
 
-  cdef Py_ssize_t arrL = len(trace) / 4
+  if isinstance(sort, basestring):
+    sort = [sort]
+  elif (sort is None):
+    sort = []
+
+  keys = set(predicates) | set(sort)
+  if (group is not None):
+    keys.add(group)
+
+  columns = source.readTraceHeaders(sorted(keys), asdict=True) if keys else {}
+
+  mask = np.ones((source.ntr,), dtype=np.bool_)
+  for key, condition in predicates.iteritems():
+    column = columns[key]
+
+    if callable(condition):
+      mask &= np.asarray(condition(column), dtype=np.bool_)
+    elif isinstance(condition, tuple):
+      if (len(condition) != 2):
+        raise SEGYFileException('Range for %s must be given as (kmin, kmax).'%(key,))
+      kmin, kmax = condition
+      if (kmin is not None):
+        mask &= (column >= kmin)
+      if (kmax is not None):
+        mask &= (column <= kmax)
+    elif isinstance(condition, (set, frozenset, list, np.ndarray)):
+      mask &= np.in1d(column, np.array(list(condition) if isinstance(condition, (set, frozenset)) else condition))
+    else:
+      mask &= (column == condition)
 
-  cdef str result = copy.copy(trace)
-  cdef char *outarr = PyString_AsString(result)
-  cdef char *inarr = PyString_AsString(trace)
+  traces = np.flatnonzero(mask).astype(np.int64)
 
-  c_ibm2ieee(outarr, inarr, arrL)
-  return result
+  if (sort):
+    traces = traces[np.lexsort([columns[key][traces] for key in reversed(sort)])]
 
-cdef extern void c_ieee2ibm "ibm2ieee" (char *outarr, char *inarr, Py_ssize_t len)
+  if (group is None):
+    return traces
 
-cdef ieee2ibm (str trace):
+  values = columns[group][traces]
+  uvalues, first, inverse = np.unique(values, return_index=True, return_inverse=True)
 
-  cdef Py_ssize_t arrL = len(trace) / 4
+  # Renumber groups by order of first appearance
+  rank = np.argsort(first, kind='mergesort')
+  groupnum = np.empty_like(rank)
+  groupnum[rank] = np.arange(len(rank))
+  tracegroup = groupnum[inverse]
 
-  cdef str result = copy.copy(trace)
-  cdef char *outarr = PyString_AsString(result)
-  cdef char *inarr = PyString_AsString(trace)
+  order = traces[np.argsort(tracegroup, kind='mergesort')]
+  counts = np.bincount(tracegroup, minlength=len(rank)).astype(np.int64)
+  stops = np.cumsum(counts)
+  starts = stops - counts
 
-  c_ieee2ibm(outarr, inarr, arrL)
-  return result
+  return uvalues[rank], order, starts, stops
 
 # ------------------------------------------------------------------------
 
@@ -229,10 +631,7 @@ class SEGYTraceHeader (object):
       index = self.sf.ntr + index
 
     sf = self.sf
-    curloc = sf._fp.tell()
-    sf._fp.seek(sf._calcHeadOffset(index+1, sf.ns))
-
-    traceheader = sf._fp.read(struct.calcsize(sf.trheadstruct))
+    traceheader = sf._readAt(sf._calcHeadOffset(index+1, sf.ns), struct.calcsize(sf.trheadstruct))
 
     traceheader = struct.unpack(sf.trheadstruct,traceheader)
     tracehead = {}
@@ -243,10 +642,313 @@ class SEGYTraceHeader (object):
     if ('PADDING' in tracehead.keys()):
       del tracehead['PADDING']
 
-    sf._fp.seek(curloc)
-
     return tracehead
 
+class SEGYNativeTraces (object):
+  '''
+  Provides native-endian copies of trace data from an existing :py:class:`SEGYFile` instance.
+  Indexing is identical to :py:meth:`SEGYFile.__getitem__`, but the result is
+  always a newly-allocated, writeable float32 array in machine byte order.
+
+  :param sf: Parent class to attach to.
+  :param sf: :py:class:`SEGYFile`
+
+  :returns: :py:class:`SEGYNativeTraces` instance
+  '''
+
+  def __init__ (self, sf):
+    self.sf = sf
+
+  def __len__ (self):
+    return self.sf.ntr
+
+  def __getitem__ (self, index):
+    '''
+    Returns traces as a native-endian float32 copy.
+
+    :param index: Slice object, trace number, integer array or boolean mask (using zero-based numbering).
+    :type traces: slice object, int, ndarray
+
+    :returns: ndarray -- 2D array containing (possibly non-adjacent) seismic traces
+    '''
+
+    return self.sf._readBulk(index, native=True)
+
+class SEGYIndex (object):
+  '''
+  Persistent sidecar index for a :py:class:`SEGYFile` instance.  The index
+  is stored next to the datafile (e.g., *file.sgy.pygeoidx*) as a sequence
+  of named NumPy arrays, which are memory-mapped when the index is opened.
+  The index is discarded and rebuilt if the size or modification time of
+  the datafile has changed.
+
+  :param sf: Parent class to attach to.
+  :param sf: :py:class:`SEGYFile`
+
+  :returns: :py:class:`SEGYIndex` instance
+  '''
+
+  suffix = '.pygeoidx'
+  version = 1
+
+  METADTYPE = np.dtype([('version', '<i8'), ('filesize', '<i8'), ('mtime', '<f8')])
+
+  def __init__ (self, sf):
+    self.sf = sf
+    self.filename = sf.filename + self.suffix
+    self.arrays = {}
+    self.valid = False
+
+    try:
+      self._load()
+    except (IOError, ValueError):
+      self.arrays = {}
+      self.valid = False
+
+    if (not self.valid):
+      self.sf._maybePrint('Header index is missing or out of date; it will be rebuilt.\n')
+
+  def _stamp (self):
+    st = os.stat(self.sf.filename)
+    return np.array([(self.version, st.st_size, st.st_mtime)], dtype=self.METADTYPE)
+
+  def _readEntry (self, fp):
+    '''
+    Reads the header of the next array in the file and returns it as a
+    read-only memory map.  Returns None at the end of the file.
+    '''
+
+    try:
+      version = np.lib.format.read_magic(fp)
+    except ValueError:
+      return None
+
+    if (version == (1, 0)):
+      shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+      shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+
+    offset = fp.tell()
+    nbytes = dtype.itemsize * int(np.prod(shape))
+    fp.seek(offset + nbytes)
+
+    if (nbytes == 0):
+      return np.empty(shape, dtype=dtype)
+
+    return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran else 'C')
+
+  def _load (self):
+    with open(self.filename, 'rb') as fp:
+      meta = self._readEntry(fp)
+      if (meta is None or meta.dtype != self.METADTYPE or not (meta == self._stamp()).all()):
+        return
+
+      while True:
+        name = self._readEntry(fp)
+        if (name is None):
+          break
+        array = self._readEntry(fp)
+        if (array is None):
+          break
+        self.arrays[str(name[()])] = array
+
+    self.valid = True
+
+  def __contains__ (self, name):
+    return name in self.arrays
+
+  def __getitem__ (self, name):
+    return self.arrays[name]
+
+  def store (self, name, array):
+    '''
+    Adds an array to the index, and appends it to the sidecar file.  If the
+    sidecar file cannot be written, the array is only kept in memory.
+
+    :param name: Name of the array.
+    :type name: str
+    :param array: Array to store.
+    :type array: ndarray
+    '''
+
+    array = np.ascontiguousarray(array)
+    self.arrays[name] = array
+
+    try:
+      with open(self.filename, 'ab' if self.valid else 'wb') as fp:
+        if (not self.valid):
+          np.lib.format.write_array(fp, self._stamp())
+          self.valid = True
+        np.lib.format.write_array(fp, np.array(name))
+        np.lib.format.write_array(fp, array)
+    except IOError:
+      self.sf._maybePrint('Could not write header index %s.\n'%(self.filename,))
+
+  def discard (self):
+    '''
+    Forgets all stored arrays (e.g., after the datafile has been modified);
+    the sidecar file is rewritten by the next call to :py:meth:`store`.
+    '''
+
+    self.arrays = {}
+    self.valid = False
+
+class SEGYCache (object):
+  '''
+  Byte-bounded least-recently-used cache of converted (native float32)
+  traces and parsed trace header rows for a :py:class:`SEGYFile` instance.
+  Cached arrays are read-only, and access is thread-safe.
+
+  :param maxbytes: Maximum total size in bytes of the cached arrays.
+  :type maxbytes: int
+
+  :returns: :py:class:`SEGYCache` instance
+
+  :var hits: *int* -- number of lookups that were found in the cache.
+  :var misses: *int* -- number of lookups that were not.
+  :var nbytes: *int* -- current total size in bytes of the cached arrays.
+  '''
+
+  def __init__ (self, maxbytes):
+    self.maxbytes = maxbytes
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self._items = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__ (self):
+    return len(self._items)
+
+  def get (self, key):
+    '''
+    Returns the cached array for a key, e.g. ('trace', 10), marking it as
+    recently used; or None if it is not cached.
+    '''
+
+    with self._lock:
+      item = self._items.pop(key, None)
+      if (item is None):
+        self.misses += 1
+        return None
+
+      self._items[key] = item
+      self.hits += 1
+      return item
+
+  def put (self, key, item):
+    '''
+    Adds an array to the cache, discarding the least-recently-used entries
+    as needed to stay within *maxbytes*.
+    '''
+
+    if (item.nbytes > self.maxbytes):
+      return
+
+    item.flags.writeable = False
+
+    with self._lock:
+      old = self._items.pop(key, None)
+      if (old is not None):
+        self.nbytes -= old.nbytes
+
+      self._items[key] = item
+      self.nbytes += item.nbytes
+
+      while (self.nbytes > self.maxbytes):
+        key, old = self._items.popitem(last=False)
+        self.nbytes -= old.nbytes
+
+  def clear (self):
+    '''
+    Discards all cached entries (e.g., after the datafile has been modified).
+    The hit and miss counters are kept.
+    '''
+
+    with self._lock:
+      self._items.clear()
+      self.nbytes = 0
+
+class SEGYSortedIndex (object):
+  '''
+  Sorted secondary index on one or more trace header keys of a
+  :py:class:`SEGYFile` (see :py:meth:`SEGYFile.sortedIndex`).  Traces are
+  sorted by the keys (most significant first; ties are kept in file
+  order), so that lookups take O(log n) time, and tables of key values can
+  be joined to the trace headers with a single vectorized search.
+
+  :param keys: Header names, most significant first.
+  :type keys: list
+  :param columns: Native-endian header columns for all traces, e.g. from :py:meth:`SEGYFile.readTraceHeaders` with *asdict=True*.
+  :type columns: dict
+  :param order: Optional precomputed sort permutation.
+  :type order: ndarray, None
+
+  :returns: :py:class:`SEGYSortedIndex` instance
+
+  :var keys: *tuple* -- header names.
+  :var order: *ndarray* -- zero-based trace numbers, in sorted order.
+  :var values: *ndarray* -- structured array of the key values, in sorted order.
+  '''
+
+  def __init__ (self, keys, columns, order=None):
+    self.keys = tuple(keys)
+
+    if (order is None):
+      order = np.lexsort([columns[key] for key in reversed(self.keys)])
+    self.order = np.asarray(order, dtype=np.int64)
+
+    self.values = np.empty((len(self.order),), dtype=[(key, columns[key].dtype) for key in self.keys])
+    for key in self.keys:
+      self.values[key] = columns[key][self.order]
+
+  def __len__ (self):
+    return len(self.order)
+
+  def _probe (self, values):
+    if (len(values) != len(self.keys)):
+      raise SEGYFileException('Expected %d key value(s): %s.'%(len(self.keys), ', '.join(self.keys)))
+
+    arrays = np.broadcast_arrays(*[np.asarray(value) for value in values])
+    probe = np.empty(arrays[0].shape, dtype=self.values.dtype)
+    for key, array in zip(self.keys, arrays):
+      probe[key] = array
+
+    return probe
+
+  def bounds (self, *values):
+    '''
+    Returns the range of positions in :py:attr:`order` that match the given
+    key values (one per key; arrays are broadcast against each other).
+
+    :returns: tuple -- (starts, stops); matches for each probe are order[starts:stops]
+    '''
+
+    probe = self._probe(values)
+    return np.searchsorted(self.values, probe, side='left'), np.searchsorted(self.values, probe, side='right')
+
+  def lookup (self, *values):
+    '''
+    Returns the trace numbers (zero-based, in file order) of all traces that
+    match the given key values, e.g. index.lookup(fldr, tracf).
+    '''
+
+    start, stop = self.bounds(*values)
+    return self.order[int(start):int(stop)]
+
+  def find (self, *values):
+    '''
+    Joins a table of key values (one array per key) to the trace headers,
+    returning the first matching trace number (zero-based) for each row, or
+    -1 where no trace matches.
+    '''
+
+    starts, stops = self.bounds(*values)
+    if (len(self.order) == 0):
+      return np.full(starts.shape, -1, dtype=np.int64)
+
+    return np.where(stops > starts, self.order[np.minimum(starts, len(self.order)-1)], -1)
+
 class SEGYFile (object):
   '''
   Provides read access to a SEG-Y dataset (headers and data).
@@ -263,18 +965,38 @@ class SEGYFile (object):
   :type endian: str
   :param usemmap: Controls whether memory-mapped I/O is used. Default True.  In most (all?) cases this should be more efficient, and will be disabled automatically if not supported.
   :type usemmap: bool
+  :param useindex: Controls whether a persistent header index (see :py:class:`SEGYIndex`) is kept next to the datafile, and memory-mapped on later opens.  Default False.
+  :type useindex: bool
+  :param lazy: Defers decoding the text header and detecting the data endian until they are first needed, so that opening a file costs little more than reading the binary header.  Default False.
+  :type lazy: bool
+  :param workers: Number of threads used to read and convert large blocks of traces (slices and arrays of trace numbers) that need format conversion.  Default 1.
+  :type workers: int
+  :param cachebytes: Size in bytes of an LRU cache (see :py:class:`SEGYCache`) of converted traces and trace header rows, for repeated random access.  Only small requests for individual traces (integer indices, or arrays of up to CACHEMAXTRACES traces) use the cache.  Default 0 (no cache).
+  :type cachebytes: int
+  :param writable: Opens the datafile for writing, with a shared memory map, so that trace headers can be modified in place with :py:meth:`SEGYFile.updateTraceHeaders`.  Default False.
+  :type writable: bool
 
   :returns: SEGYFile instance
 
   :var thead: *str* -- contains an ASCII-encoded translation of the EBCDIC 3200-byte tape header. 
-  :var bhead: *dict* -- contains key:value pairs describing the data in the 400-byte binary reel header.
+  :var textheaders: *list* -- ASCII translations of any extended 3200-byte textual header records.
+  :var bhead: *dict* -- contains key:value pairs describing the data in the 400-byte binary reel header, including the SEG-Y rev2 fields (see BHEADREV2LIST).
+  :var headerorder: *str* -- NumPy byte-order character ('>' or '<') of the headers (and data), if the binary header has the rev2 byte-order word; otherwise None, and the headers are read as big-endian.
+  :var dataoffset: *int* -- byte offset of the first trace header, after the binary header and any extended textual header records.
   :var trhead: :py:class:`SEGYTraceHeader` instance -- acts like a list of all the trace headers.  Individual items each return a dictionary that contains key:value pairs describing the data in the trace header.
+  :var native: :py:class:`SEGYNativeTraces` instance -- indexes like the :py:class:`SEGYFile` itself, but always returns native-endian float32 copies of the traces.
   :var endian: *str* -- describing the endian of the datafile.
+  :var endianconfidence: *float* -- fraction (0.5 to 1) of the non-zero samples tested that favour the autodetected endian; None if the endian was specified or could not be detected.
   :var mendian: *str* -- autodetected machine endian.
   :var ns: *int* -- number of samples in each trace.
   :var ntr: *int* -- number of traces in dataset.
+  :var trheaddtype: *dtype* -- structured dtype describing one 240-byte trace header, including any *extraheaders*, in the byte order of the file (big-endian unless *headerorder* says otherwise).
+  :var traceoffsets: *ndarray* -- for files whose traces have different numbers of samples, the byte offset of each trace header (plus the end of the last trace); otherwise None.  For such files, *ns* is the largest number of samples in any trace, and traces are read zero-padded to that length.
+  :var tracens: *ndarray* -- number of samples in each trace, if *traceoffsets* is in use; otherwise None.
   :var filesize: *int* -- size of datafile in bytes.
-  :var ensembles: *dict* -- only exists if the experimental function :py:func:`SEGYFile._calcEnsembles` is called.  Maps shot gather numbers to trace numbers.  *Experimental*
+  :var index: :py:class:`SEGYIndex` instance -- persistent header index, if *useindex* is True; otherwise None.
+  :var cache: :py:class:`SEGYCache` instance -- trace and header cache, if *cachebytes* is nonzero; otherwise None.
+  :var ensembles: *dict* -- only exists if the legacy function :py:func:`SEGYFile._calcEnsembles` is called.  Maps shot gather numbers to the first trace number of each gather.  See :py:meth:`SEGYFile.calcEnsembles` for general ensemble detection.
 
   '''
 
@@ -282,15 +1004,35 @@ class SEGYFile (object):
   verbose = False
   majorheadersonly = True
   isSU = False
-  endian = 'Big'
+  _endian = 'Big'
+  _endianconfidence = None
+  _endianpending = False
 
   samplen = 4
 
   mendian = None
   usemmap = True
-  thead = None
+  useindex = False
+  lazy = False
+  workers = 1
+  cachebytes = 0
+  cache = None
+  writable = False
+  traceoffsets = None
+  tracens = None
+  headerorder = None
+  dataoffset = 0
+  databytes = 0
+  _textheaders = None
+  _textend = 3600
+  index = None
+  _sortedindexes = None
+  _fp = None
+  trheaddtype = None
+  _thead = None
   bhead = None
   trhead = None
+  native = None
   ensembles = None
   initialized = False
   filesize = 0
@@ -334,6 +1076,7 @@ class SEGYFile (object):
 
     self.trheadlist = trheadlist
     self.trheadstruct = ''.join(trheadstructlist)
+    self.trheaddtype = _traceHeaderDtype(localdict)
 
   # --------------------------------------------------------------------
 
@@ -379,210 +1122,1298 @@ class SEGYFile (object):
     self._maybePrint('Reading SEG-Y headers...')
 
     if (not self.isSU):
-      textheader = self._fp.read(3200).replace(' ','\x25').decode('IBM500')
-      textheader = '\n'.join(textheader[pos:pos+80] for pos in xrange(0, len(textheader), 80))
-
-      blockheader = self._fp.read(400)
+      if (not self.lazy):
+        self._thead = self._readTextHeader()
+
+      blockheader = self._readAt(3200, 400)
+
+      # The rev2 byte-order word gives the byte order of all headers (and
+      # data); files without it are big-endian
+      if (blockheader[96:100] == struct.pack('<L', BYTEORDERWORD)):
+        self.headerorder = '<'
+        self.trheadstruct = '<' + self.trheadstruct[1:]
+        self.trheaddtype = self.trheaddtype.newbyteorder('<')
+      elif (blockheader[96:100] == struct.pack('>L', BYTEORDERWORD)):
+        self.headerorder = '>'
+      else:
+        self.headerorder = None
 
-      blockheader = struct.unpack(BHEADSTRUCT,blockheader[:60])
+      order = self.headerorder or '>'
       bhead = {}
 
+      values = struct.unpack(order + BHEADSTRUCT[1:], blockheader[:60])
       for i, label in enumerate(BHEADLIST):
-        bhead[label] = blockheader[i]
+        bhead[label] = values[i]
 
-      if (bhead['hns'] != 0):
-        self.ns = bhead['hns']
-      else:
-        traceheader = self._fp.read(240)
-        traceheader = struct.unpack(self.trheadstruct,traceheader[:180])
-        self.ns = traceheader[38]
+      values = struct.unpack(order + BHEADREV2STRUCT, blockheader[60:60+struct.calcsize('>' + BHEADREV2STRUCT)])
+      for i, label in enumerate(BHEADREV2LIST):
+        bhead[label] = values[i]
+
+      self.bhead = bhead
+      self._findDataOffset()
+      self.ns = self._findSampleCount()
+      self._getSamplen()
+
+      # Legacy files often have junk where SEG-Y rev1/rev2 put the revision
+      # fields; if the layout they give does not fit, they are ignored
+      if (bhead['revmajor'] >= 1 and not self._layoutFits()):
+        warnings.warn('%s: the SEG-Y revision %d fields of the binary header do not fit the file size; using the rev1 layout without extended headers.'%(self.filename, bhead['revmajor']))
+        bhead['revmajor'] = 1
+        bhead['ntexthead'] = 0
+        self._findDataOffset()
+        self.ns = self._findSampleCount()
+
+      if (bhead['revmajor'] >= 2 and bhead['ntrhead'] > 0):
+        raise SEGYFileException('Additional (rev2) trace headers are not supported.')
 
     else:
-      textheader = None
-      bhead = None
+      self.bhead = None
+      self.dataoffset = 0
+      self.databytes = self.filesize
 
-      traceheader = self._fp.read(240)
+      traceheader = self._readAt(0, 240)
       traceheader = struct.unpack(self.trheadstruct,traceheader[:180])
       self.ns = traceheader[38]
 
-    self.thead = textheader
-    self.bhead = bhead
-
     # Determine length of each sample from FORMAT code
     self._getSamplen()
 
     self.trhead = SEGYTraceHeader(self)
+    self.native = SEGYNativeTraces(self)
 
     self._maybePrint('Read SEG-Y headers.\n\t%d traces present.\n' % (self.ntr))
 
     return
 
-  # --------------------------------------------------------------------
-
-  def _calcHeadOffset (self, trace, ns):
+  def _findDataOffset (self):
     '''
-    Calculates the byte offset of the beginning of the head portion of a
-    seismic trace, given the trace number and the number of samples per.
+    Finds the byte offset of the first trace header, after any extended
+    textual header records (counted in the binary header, or terminated by
+    an EndText stanza), and the number of trace bytes in the file.
     '''
 
-    if (not self.isSU):
-      return 3200 + 400 + (ns*self.samplen + 240)*(trace-1)
-    else:
-      return (ns*4 + 240)*(trace-1)
+    bhead = self.bhead
+    self.dataoffset = 3600
+    ntexthead = bhead['ntexthead'] if (bhead['revmajor'] >= 1) else 0
 
-  def _calcDataOffset (self, trace, ns):
+    if (ntexthead > 0):
+      self.dataoffset += 3200*ntexthead
+    elif (ntexthead == -1):
+      while (self.dataoffset + 3200 <= self.filesize):
+        record = self._decodeText(self._readAt(self.dataoffset, 3200))
+        self.dataoffset += 3200
+        if (ENDTEXTSTANZA in record.replace('\n', '')):
+          break
+
+    self._textend = min(self.dataoffset, self.filesize)
+
+    if (bhead['revmajor'] >= 2 and bhead['firsttrace'] > 0):
+      self.dataoffset = bhead['firsttrace']
+
+    self.databytes = self.filesize - self.dataoffset
+    if (bhead['revmajor'] >= 2 and bhead['ntrailer'] > 0):
+      self.databytes -= 3200*bhead['ntrailer']
+
+  def _findSampleCount (self):
     '''
-    Calculates the byte offset of the beginning of the data portion of a
-    seismic trace, given the trace number and the number of samples per.
+    Returns the number of samples per trace, from the binary header (or the
+    rev2 extended sample count), or else from the first trace header.
     '''
 
-    return self._calcHeadOffset(trace, ns) + 240
+    bhead = self.bhead
 
-  # --------------------------------------------------------------------
+    if (bhead['revmajor'] >= 2 and bhead['extns'] > 0):
+      return bhead['extns']
+    elif (bhead['hns'] != 0):
+      return bhead['hns']
 
-  def _detectFileEndian (self):
-    if (self.endian != 'Auto'):
-      self._maybePrint('%s endian specified... Not autodetecting.'%(self.endian,))
-      if (self.endian != self.mendian):
-        self._maybePrint('%s endian != %s endian, therefore Foreign.'%(self.endian,self.mendian))
-        self.endian = 'Foreign'
-    else:
-      self._maybePrint('Auto endian specified... Trying to autodetect data endianness.')
-      with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        for i in xrange(self.ntr):
-          locar = self[i]
-          if ((not abs(locar).sum() == 0.) and (not np.isnan(locar.mean()))):
-            nexp = abs(np.frexp(locar.astype(np.float64)**2)[1]).mean()
-            locar = locar.newbyteorder()
-            fexp = abs(np.frexp(locar.astype(np.float64)**2)[1]).mean()
-            if (fexp > nexp):
-              self.endian = 'Native'
-            else:
-              self.endian = 'Foreign'
-            self._maybePrint('Scanned %d trace(s). Endian appears to be %s.'%(i, self.endian))
-            break
+    traceheader = self._readAt(self.dataoffset, 240)
+    if (len(traceheader) < 180):
+      return 0
 
-      if (self.endian == 'Foreign'):
-        self._maybePrint('Will attempt to convert to %s endian when traces are read.\n'%(self.mendian,))
-      elif (self.endian == 'Auto'):
-        self._maybePrint('Couldn\'t find any non-zero traces to test!\nAssuming Native endian.\n')
+    return struct.unpack(self.trheadstruct, traceheader[:180])[38]
 
+  def _layoutFits (self):
+    '''
+    Checks the trace layout given by the revision fields of the binary
+    header (extended text headers, first trace offset, trailer records,
+    extended sample count and trace count) against the size of the file.
+    The layout does not fit if it starts past the end of the file, if it
+    counts more traces than the file holds, or if it leaves a partial trace
+    where the rev1 layout (traces from byte 3600, with the sample count of
+    the standard binary header) accounts for the file exactly.
+    '''
 
-  # --------------------------------------------------------------------
+    if (self.dataoffset < 3600 or self.dataoffset > self.filesize or self.databytes < 0):
+      return False
 
-  @cython.wraparound(False)
-  @cython.boundscheck(False)
-  def readTraces (self, traces=None):
-    '''
-    Returns trace data as a list of numpy arrays (i.e. non-adjacent trace
-    numbers are allowed). Requires that traces be fixed length.
+    reclen = self.ns*self.samplen + 240
 
-    :param traces: List of traces to return, using 1-based trace numbering.  Optional; if omitted, all traces are returned.
-    :type traces: list, None
+    # Traces may be shorter than ns if the file says they vary in length
+    if (self.bhead['revmajor'] >= 2 and self.bhead['trflag'] != 1 and self.bhead['ntrfile']*reclen > self.databytes):
+      return False
 
-    :returns: ndarray -- 2D array containing (possibly non-adjacent) seismic traces
+    if (self.databytes % reclen == 0):
+      return True
 
-    .. versionchanged:: devel
-    This is now a legacy interface, and is superseded by the __getitem__
-    interface, which uses standard Python slice notation.
-    '''
+    # A partial trace is otherwise allowed (e.g., for variable-length traces)
+    ns = self.bhead['hns']
+    if (ns == 0 and self.filesize >= 3780):
+      ns = struct.unpack(self.trheadstruct, self._readAt(3600, 180))[38]
 
-    if (traces == None):
-      return self.__getitem__(slice(None))
+    return not (ns > 0 and (self.filesize - 3600) % (ns*self.samplen + 240) == 0)
 
-    if not np.iterable(traces):
-      return self.__getitem__(traces-1)
+  def _decodeText (self, textheader):
+    '''
+    Converts a 3200-byte text header record to ASCII text in lines of 80
+    characters.  Records are EBCDIC (IBM500), unless they look like ASCII,
+    which SEG-Y rev2 also allows.
+    '''
+
+    if (textheader.count(' ') > textheader.count('\x40')):
+      textheader = textheader.decode('ascii', 'replace')
     else:
-      return np.array([self.__getitem__(trace-1) for trace in traces], dtype=np.float32)
+      textheader = textheader.replace(' ','\x25').decode('IBM500')
+    return '\n'.join(textheader[pos:pos+80] for pos in xrange(0, len(textheader), 80))
 
-  def __getitem__ (self, index):
+  def _readTextHeader (self):
     '''
-    Returns traces from the open seismic dataset, with support for standard
+    Reads the 3200-byte text header, and returns it as ASCII text (converted
+    from IBM500 EBCDIC) in lines of 80 characters.
+    '''
+
+    return self._decodeText(self._readAt(0, 3200))
+
+  @property
+  def thead (self):
+    if (self._thead is None and not self.isSU):
+      self._thead = self._readTextHeader()
+    return self._thead
+
+  @property
+  def textheaders (self):
+    if (self._textheaders is None and not self.isSU):
+      self._textheaders = [self._decodeText(self._readAt(offset, 3200)) for offset in xrange(3600, self._textend - 3199, 3200)]
+    return self._textheaders
+
+  # --------------------------------------------------------------------
+
+  def _readAt (self, offset, length):
+    '''
+    Reads a byte range from the datafile.  This never uses the shared file
+    position (the memory map is sliced, or pread is used for conventional
+    I/O), so a single SEGYFile instance can be read from several threads.
+    '''
+
+    self._checkOpen()
+
+    if (self.usemmap):
+      return self._fp[offset:offset+length]
+    else:
+      return _pread(self._fp.fileno(), length, offset)
+
+  def _calcHeadOffset (self, trace, ns):
+    '''
+    Calculates the byte offset of the beginning of the head portion of a
+    seismic trace, given the trace number and the number of samples per.
+    '''
+
+    if (self.traceoffsets is not None):
+      return int(self.traceoffsets[trace-1])
+
+    return self.dataoffset + (ns*self.samplen + 240)*(trace-1)
+
+  def _calcDataOffset (self, trace, ns):
+    '''
+    Calculates the byte offset of the beginning of the data portion of a
+    seismic trace, given the trace number and the number of samples per.
+    '''
+
+    return self._calcHeadOffset(trace, ns) + 240
+
+  def _checkTraceLengths (self):
+    '''
+    Checks whether all traces have the same number of samples: the file
+    size must be a whole number of trace records, and the ns headers of the
+    first and last traces must agree with the binary header.  If not (and
+    the ns header of the first trace is usable), the trace boundaries are
+    found by scanning the file (or loaded from the persistent index), and
+    the file is read as variable-length traces.
+    '''
+
+    first = self._calcHeadOffset(1, self.ns)
+    reclen = self.ns*self.samplen + 240
+
+    if (self.databytes < 240):
+      return
+
+    # SEG-Y rev2 files can declare that all traces have the same length
+    if (not self.isSU and self.bhead['revmajor'] >= 2 and self.bhead['trflag'] == 1):
+      return
+
+    # Trace headers that leave ns unset (or byte-swapped, or too small to
+    # hold it) can't be followed
+    order = self.headerorder or '>'
+    nsfirst = struct.unpack(order + 'H', self._readAt(first + 114, 2))[0]
+    if (nsfirst == 0 or self.ns > 0xFFFF or (nsfirst != self.ns and struct.unpack('<H', struct.pack('>H', nsfirst))[0] == self.ns)):
+      return
+
+    counted = (not self.isSU and self.bhead['revmajor'] >= 2 and self.bhead['ntrfile'] == self.ntr)
+    consistent = (self.databytes % reclen == 0 or counted) and (nsfirst == self.ns)
+    if (consistent and self.ntr > 1):
+      nsword = self._readAt(self._calcHeadOffset(self.ntr, self.ns) + 114, 2)
+      consistent = (struct.unpack(order + 'H', nsword)[0] == self.ns)
+
+    if (consistent):
+      return
+
+    if (self.index is not None and 'traceoffsets' in self.index):
+      offsets = self.index['traceoffsets']
+    else:
+      self._maybePrint('Traces have different lengths; scanning trace headers...')
+      offsets = _scanTraceOffsets(self._gatherSource(), first, self.dataoffset + self.databytes, self.samplen, order == '<')
+      if (self.index is not None):
+        self.index.store('traceoffsets', offsets)
+
+    self.traceoffsets = np.asarray(offsets, dtype=np.int64)
+    self.tracens = (np.diff(self.traceoffsets) - 240) // self.samplen
+    self.ntr = len(self.tracens)
+    if (self.ntr > 0):
+      self.ns = int(self.tracens.max())
+
+    self._maybePrint('Found %d trace(s) of up to %d samples.\n'%(self.ntr, self.ns))
+
+  def _gatherSource (self):
+    '''
+    Returns the memory map (as a uint8 array) or file descriptor to read
+    from with _gatherBytes.
+    '''
+
+    self._checkOpen()
+
+    if (self.usemmap):
+      return np.frombuffer(self._fp, dtype=np.uint8)
+    else:
+      return self._fp.fileno()
+
+  def _readRaggedData (self, index, dtype, samples):
+    '''
+    Reads trace data from a file with variable-length traces into a block
+    padded with zeros to *ns* samples, then applies the sample index.
+    '''
+
+    traces = self._traceArray(index)
+    (lo, hi), window = self._sampleWindow(samples)
+    width = hi - lo
+
+    starts = self.traceoffsets[traces] + 240 + lo*dtype.itemsize
+    lengths = (np.clip(self.tracens[traces] - lo, 0, width)*dtype.itemsize).astype(np.int64)
+
+    block = np.empty((len(traces), width*dtype.itemsize), dtype=np.uint8)
+    _gatherBytes(self._gatherSource(), starts, lengths, block)
+    block = block.view(dtype).reshape((len(traces), width))[:, window]
+
+    if (not isinstance(index, (slice, list, np.ndarray))):
+      return block[0]
+
+    return block
+
+  # --------------------------------------------------------------------
+
+  @property
+  def endian (self):
+    # Detection runs once, under the lock; the flag is only cleared after
+    # _endian holds the result, so other threads never see the fallback
+    if (self._endianpending):
+      with self._endianlock:
+        if (self._endianpending):
+          self._detectFileEndian()
+          self._endianpending = False
+    return self._endian
+
+  @endian.setter
+  def endian (self, value):
+    with self._endianlock:
+      self._endian = value
+      self._endianpending = False
+
+  @property
+  def endianconfidence (self):
+    self.endian
+    return self._endianconfidence
+
+  def _detectFileEndian (self):
+    if (self._endian != 'Auto'):
+      self._maybePrint('%s endian specified... Not autodetecting.'%(self._endian,))
+      if (self._endian != self.mendian):
+        self._maybePrint('%s endian != %s endian, therefore Foreign.'%(self._endian,self.mendian))
+        self._endian = 'Foreign'
+    else:
+      self._maybePrint('Auto endian specified... Trying to autodetect data endianness.')
+      score = self._scoreEndian()
+
+      if (score is not None):
+        bigconf, ntraces = score
+        if ((bigconf >= 0.5) == (self.mendian == 'Big')):
+          self._endian = 'Native'
+        else:
+          self._endian = 'Foreign'
+        self._endianconfidence = max(bigconf, 1. - bigconf)
+        self._maybePrint('Scanned %d trace(s). Endian appears to be %s (confidence %.2f).'%(ntraces, self._endian, self._endianconfidence))
+
+      if (self._endian == 'Foreign'):
+        self._maybePrint('Will attempt to convert to %s endian when traces are read.\n'%(self.mendian,))
+      elif (self._endian == 'Auto'):
+        self._maybePrint('Couldn\'t find any non-zero samples to test in %d sampled trace(s)!\nAssuming Big endian.\n'%(min(self.ntr, ENDIANSAMPLE),))
+
+  def _scoreEndian (self):
+    '''
+    Reads a fixed-size random sample of traces in a single batch, decodes the
+    raw samples as both big- and little-endian, and compares the magnitude of
+    the binary exponents of the squared values; real data have exponents
+    near zero, while byte-swapped data generally do not (or are not finite).
+
+    :returns: tuple -- (fraction of non-zero samples that favour big-endian, number of traces read), or None if there was nothing to test
+    '''
+
+    format = 5 if self.isSU else self.bhead['format']
+
+    if (format == 1):
+      code = 'u4'
+    elif (format in FORMATDTYPES and np.dtype(FORMATDTYPES[format][0]).itemsize > 1):
+      code = FORMATDTYPES[format][0]
+    else:
+      # One-byte integers have no byte order; formats 4, 7 and 15 are not tested
+      return None
+
+    width = 'u%d'%(np.dtype(code).itemsize,)
+
+    if (self.ntr == 0 or self.ns == 0):
+      return None
+
+    # Distinct random trace numbers (seeded by the trace count, so that the
+    # result is repeatable), drawn without building a permutation of all
+    # the traces
+    ntraces = min(self.ntr, ENDIANSAMPLE)
+    rng = np.random.RandomState(self.ntr % 2**32)
+    traces = np.unique(rng.randint(0, self.ntr, size=ntraces).astype(np.int64))
+    while (len(traces) < ntraces):
+      traces = np.unique(np.concatenate((traces, rng.randint(0, self.ntr, size=ntraces - len(traces)).astype(np.int64))))
+
+    raw = np.ascontiguousarray(self._readTraceData(traces, '>' + width), dtype='>' + width)
+
+    # The same bytes, read as little-endian
+    swapped = raw.byteswap()
+    if (format == 1):
+      cands = np.array([ibm2ieeeBlock(raw), ibm2ieeeBlock(swapped)], dtype=np.float64)
+    else:
+      cands = np.array([raw.view('>' + code), swapped.view('>' + code)], dtype=np.float64)
+
+    with np.errstate(all='ignore'):
+      exps = abs(np.frexp(cands**2)[1]).astype(np.float64)
+      # Non-finite values (and overflow on squaring) count against an endian
+      exps[~np.isfinite(cands**2)] = np.inf
+
+    nonzero = (cands != 0).all(axis=0)
+    if (not nonzero.any()):
+      return None
+
+    big, little = exps[0][nonzero], exps[1][nonzero]
+    votes = (big < little).sum() + 0.5*(big == little).sum()
+
+    return float(votes) / nonzero.sum(), len(traces)
+
+  def _dataByteOrder (self):
+    '''
+    Returns the NumPy byte-order character ('>' or '<') of the trace data
+    stored in the file.  Data are assumed to be big-endian until the endian
+    has been detected.
+    '''
+
+    if (self.endian == 'Auto'):
+      return '>'
+
+    if ((self.endian == 'Foreign') == (self.mendian == 'Little')):
+      return '>'
+    else:
+      return '<'
+
+  # --------------------------------------------------------------------
+
+  def _getTraceView (self, dtype):
+    '''
+    Returns a read-only (ntr, ns) ndarray over the memory map, with strides
+    that skip the 240-byte trace headers.  No data are copied.
+    '''
+
+    self._checkOpen()
+
+    dtype = np.dtype(dtype)
+
+    view = np.ndarray((self.ntr, self.ns), dtype=dtype, buffer=self._fp,
+                      offset=self._calcDataOffset(1, self.ns),
+                      strides=(self.ns*self.samplen + 240, dtype.itemsize))
+    view.flags.writeable = False
+
+    return view
+
+  def _traceList (self, index):
+    '''
+    Converts an integer array (or list) or boolean mask of trace numbers
+    into a validated array of non-negative trace numbers (zero-based).
+    '''
+
+    index = np.asarray(index)
+
+    if (index.dtype == np.bool_):
+      if (index.shape != (self.ntr,)):
+        raise IndexError('boolean index must have one entry per trace')
+      return np.flatnonzero(index)
+
+    index = index.astype(np.int64).ravel()
+    index = np.where(index < 0, index + self.ntr, index)
+    if (len(index) > 0 and (index.min() < 0 or index.max() >= self.ntr)):
+      raise IndexError('trace index out of range')
+
+    return index
+
+  def _traceArray (self, index):
+    '''
+    Converts any trace index (trace number, slice, integer array or boolean
+    mask) into a validated array of non-negative trace numbers.
+    '''
+
+    if isinstance(index, slice):
+      return np.arange(*index.indices(self.ntr))
+
+    if isinstance(index, (list, np.ndarray)):
+      return self._traceList(index)
+
+    return self._traceList([index])
+
+  def _traceRuns (self, traces):
+    '''
+    Splits a sorted array of unique trace numbers into runs of consecutive
+    traces; returns the (start, stop) trace numbers of each run.
+    '''
+
+    bounds = np.flatnonzero(np.diff(traces) != 1) + 1
+    starts = traces[np.concatenate(([0], bounds)).astype(np.int64)]
+    stops = traces[np.concatenate((bounds - 1, [len(traces) - 1])).astype(np.int64)] + 1
+
+    return starts, stops
+
+  def _sampleWindow (self, samples):
+    '''
+    Converts a sample index (number or slice) into the contiguous window of
+    samples (lo, hi) that must be read, and the index to apply within that
+    window.
+    '''
+
+    if isinstance(samples, slice):
+      start, stop, step = samples.indices(self.ns)
+      picks = xrange(start, stop, step)
+      if (len(picks) == 0):
+        return (0, 0), slice(0, 0)
+      lo = min(picks[0], picks[-1])
+      hi = max(picks[0], picks[-1]) + 1
+      last = picks[-1] - lo + (1 if step > 0 else -1)
+      return (lo, hi), slice(picks[0] - lo, None if last < 0 else last, step)
+
+    if (samples < 0):
+      samples = self.ns + samples
+    if (samples < 0 or samples >= self.ns):
+      raise IndexError('sample index out of range')
+
+    return (samples, samples+1), 0
+
+  def _readWindow (self, start, stop, step, lo, hi, dtype):
+    '''
+    Reads samples lo:hi of the traces in range(start, stop, step), without
+    the memory map.  Contiguous traces are read in a single operation when
+    the window covers most of each trace record; otherwise only the window
+    is read from each trace.
+    '''
+
+    ns = self.ns
+    reclen = ns*self.samplen + 240
+    traces = xrange(start, stop, step)
+    ntraces = len(traces)
+    width = (hi - lo)*dtype.itemsize
+
+    if (ntraces == 0 or width <= 0):
+      return np.empty((ntraces, max(hi - lo, 0)), dtype=dtype)
+
+    if (step == 1 and 2*width >= reclen):
+      buf = self._readAt(self._calcHeadOffset(start+1, ns), ntraces*reclen)
+      offset, stride = 240 + lo*dtype.itemsize, reclen
+    else:
+      chunks = []
+      for trace in traces:
+        chunks.append(self._readAt(self._calcDataOffset(trace+1, ns) + lo*dtype.itemsize, width))
+      buf = ''.join(chunks)
+      offset, stride = 0, width
+
+    return np.ndarray((ntraces, hi - lo), dtype=dtype, buffer=buf, offset=offset,
+                      strides=(stride, dtype.itemsize))
+
+  def _readTraceData (self, index, dtype, samples=None):
+    '''
+    Reads the raw sample data for an index (trace number, slice, integer
+    array or boolean mask) and optional sample index (number or slice), and
+    returns it as an ndarray of the requested dtype.  Uses the memory map
+    when available, in which case the result for a trace number or slice is
+    a view; otherwise only the bytes in the sample window are read.  Arrays
+    of trace numbers are sorted and coalesced into contiguous runs, read one
+    run at a time, and returned in the requested order.
+    '''
+
+    dtype = np.dtype(dtype)
+
+    if (samples is None):
+      samples = slice(None)
+
+    if (self.traceoffsets is not None):
+      return self._readRaggedData(index, dtype, samples)
+
+    if (self.usemmap):
+      view = self._getTraceView(dtype)[:, samples]
+
+      if isinstance(index, (list, np.ndarray)):
+        unique, inverse = np.unique(self._traceList(index), return_inverse=True)
+        return view[unique][inverse]
+
+      return view[index]
+
+    (lo, hi), window = self._sampleWindow(samples)
+
+    if isinstance(index, (list, np.ndarray)):
+      unique, inverse = np.unique(self._traceList(index), return_inverse=True)
+
+      block = np.empty((len(unique), hi - lo), dtype=dtype)
+      if (len(unique) > 0):
+        pos = 0
+        for start, stop in zip(*self._traceRuns(unique)):
+          block[pos:pos+stop-start] = self._readWindow(start, stop, 1, lo, hi, dtype)
+          pos += stop - start
+
+      return block[inverse][:, window]
+
+    if isinstance(index, slice):
+      start, stop, step = index.indices(self.ntr)
+      return self._readWindow(start, stop, step, lo, hi, dtype)[:, window]
+
+    if (index < 0):
+      index = self.ntr + index
+    if (index < 0 or index >= self.ntr):
+      raise IndexError('trace index out of range')
+
+    return self._readWindow(index, index+1, 1, lo, hi, dtype)[0, window]
+
+  def _getHeaderView (self, keys=None):
+    '''
+    Returns a read-only (ntr,) structured ndarray over the memory map,
+    covering the trace headers only (i.e., strided over the trace data).
+    Optionally restricted to a subset of header fields.  No data are copied.
+    '''
+
+    self._checkOpen()
+
+    dtype = self._headerDtype(keys)
+
+    view = np.ndarray((self.ntr,), dtype=dtype, buffer=self._fp,
+                      offset=self._calcHeadOffset(1, self.ns),
+                      strides=(self.ns*self.samplen + 240,))
+    view.flags.writeable = False
+
+    return view
+
+  def _headerDtype (self, keys=None):
+    '''
+    Returns the trace header dtype, restricted to a subset of fields.
+    '''
+
+    if (keys is None):
+      return self.trheaddtype
+
+    fields = self.trheaddtype.fields
+    for key in keys:
+      if (key not in fields):
+        raise SEGYFileException('Invalid trace header: %s'%key)
+
+    return np.dtype({'names': list(keys),
+                     'formats': [fields[key][0] for key in keys],
+                     'offsets': [fields[key][1] for key in keys],
+                     'itemsize': 240})
+
+  def readTraceHeaders (self, keys=None, traces=None, asdict=False):
+    '''
+    Returns trace headers as columns, read in a single pass over the file.
+    This is much faster than iterating over :py:attr:`SEGYFile.trhead` when
+    only a few header values are needed for many traces.
+
+    :param keys: Header names to return (uses lower-case SU names; see TRHEADLIST).  Optional; if omitted, all headers (including *extraheaders*) are returned.
+    :type keys: list, None
+    :param traces: Slice object, trace number or array of trace numbers (using zero-based numbering).  Optional; if omitted, all traces are returned.
+    :type traces: slice object, int, ndarray, None
+    :param asdict: Return a dictionary of 1D arrays rather than a structured array.
+    :type asdict: bool
+
+    :returns: ndarray, dict -- native-endian structured array (or dict of arrays) with one entry per trace
+    '''
+
+    if (traces is None):
+      traces = slice(None)
+
+    return self._readHeaderColumns(keys, traces, asdict, self._cacheable(traces))
+
+  def _readHeaderColumns (self, keys, traces, asdict, cached):
+    '''
+    Implements :py:meth:`SEGYFile.readTraceHeaders`; header rows are read
+    through the cache only if *cached* is True.
+    '''
+
+    dtype = self._headerDtype(keys)
+
+    view = None
+    if (cached):
+      view = self._readCachedHeaders(traces)
+
+    if (view is None):
+      view = self._readHeaderRows(keys, traces)
+
+    names = dtype.names
+    native = np.dtype([(name, dtype.fields[name][0].newbyteorder('=')) for name in names])
+
+    if (asdict):
+      return dict((name, np.array(view[name], dtype=native[name])) for name in names)
+
+    result = np.empty(np.shape(view), dtype=native)
+    for name in names:
+      result[name] = view[name]
+
+    return result
+
+  def _readHeaderRows (self, keys, traces):
+    '''
+    Returns the trace header rows for an index, from the persistent index,
+    the memory map or the file, without converting them to native endian.
+    '''
+
+    if (self.index is not None):
+      return self._getIndexedHeaders()[traces]
+
+    if (self.traceoffsets is not None):
+      tracelist = self._traceArray(traces)
+      block = np.empty((len(tracelist), 240), dtype=np.uint8)
+      _gatherBytes(self._gatherSource(), self.traceoffsets[tracelist], np.full(tracelist.shape, 240, dtype=np.int64), block)
+      view = block.view(self.trheaddtype).reshape((len(tracelist),))
+      if (not (isinstance(traces, slice) or np.iterable(traces))):
+        view = view[0]
+      return view
+
+    if (self.usemmap):
+      return self._getHeaderView(keys)[traces]
+
+    if isinstance(traces, slice):
+      tracelist = xrange(*traces.indices(self.ntr))
+    else:
+      tracelist = np.arange(self.ntr)[traces].ravel()
+
+    chunks = []
+    for trace in tracelist:
+      chunks.append(self._readAt(self._calcHeadOffset(trace+1, self.ns), 240))
+
+    view = np.frombuffer(''.join(chunks), dtype=self._headerDtype(keys))
+    if (not (isinstance(traces, slice) or np.iterable(traces))):
+      view = view[0]
+
+    return view
+
+  def updateTraceHeaders (self, key, values, traces=None):
+    '''
+    Writes new values of one trace header into the datafile, in place, for
+    all traces or a subset of them.  With the memory map, this is a single
+    strided assignment that converts the values to the type and byte order
+    of the header (see TRHEADDICT).  Requires *writable=True*.  Any cached
+    headers and traces, sorted indexes and persistent index are discarded.
+
+    :param key: Header name (uses lower-case SU names; see TRHEADLIST).
+    :type key: str
+    :param values: New values; a single value, or one value per selected trace.  Floating point values are truncated towards zero.
+    :type values: ndarray, list, int
+    :param traces: Slice object, trace number, integer array or boolean mask (using zero-based numbering).  Optional; if omitted, all traces are updated.
+    :type traces: slice object, int, ndarray, None
+    '''
+
+    self._checkOpen()
+
+    if (not self.writable):
+      raise SEGYFileException('File is not open for writing; use writable=True.')
+
+    fieldtype, fieldoffset, values = self._checkHeaderValues(key, values)
+
+    if (traces is None):
+      traces = slice(None)
+
+    reclen = self.ns*self.samplen + 240
+    first = self._calcHeadOffset(1, self.ns) + fieldoffset
+
+    if (self.usemmap and self.traceoffsets is None):
+      view = np.ndarray((self.ntr,), dtype=fieldtype, buffer=self._fp, offset=first, strides=(reclen,))
+      view[traces] = values
+    else:
+      tracelist = self._traceArray(traces)
+      packed = np.empty(tracelist.shape, dtype=fieldtype)
+      packed[...] = values
+
+      if (self.traceoffsets is not None):
+        offsets = self.traceoffsets[tracelist] + fieldoffset
+      else:
+        offsets = first + tracelist*reclen
+
+      if (self.usemmap):
+        mapped = np.frombuffer(self._fp, dtype=np.uint8)
+        mapped[offsets[:, np.newaxis] + np.arange(fieldtype.itemsize)] = packed.view(np.uint8).reshape((-1, fieldtype.itemsize))
+      else:
+        for i, offset in enumerate(offsets):
+          _pwrite(self._fp.fileno(), packed[i:i+1].tostring(), offset)
+
+    if (self.cache is not None):
+      self.cache.clear()
+    if (self.index is not None):
+      self.index.discard()
+    self._sortedindexes = {}
+
+  def _checkHeaderValues (self, key, values):
+    '''
+    Checks that new values of a trace header fit its type, and returns the
+    type and byte offset of the field, and the values as an array.
+    '''
+
+    if (key not in self.trheaddtype.fields):
+      raise SEGYFileException('Invalid trace header: %s'%key)
+
+    fieldtype, fieldoffset = self.trheaddtype.fields[key][:2]
+
+    values = np.asarray(values)
+    limits = _fieldOverflow(fieldtype, values)
+    if (limits is not None):
+      raise SEGYFileException('Values for %s must be in the range [%d, %d].'%(key, limits[0], limits[1]))
+
+    return fieldtype, fieldoffset, values
+
+  def flush (self):
+    '''
+    Writes any modified pages of the memory map back to the datafile.
+    '''
+
+    if (self.writable and self._fp is not None):
+      self._fp.flush()
+
+  def _readCachedHeaders (self, traces):
+    '''
+    Returns full, native-endian trace header rows for an index, using the
+    cache; or None if the request is too large to cache.
+    '''
+
+    tracelist = self._traceArray(traces)
+    native = np.dtype([(name, self.trheaddtype.fields[name][0].newbyteorder('=')) for name in self.trheaddtype.names])
+
+    if (len(tracelist)*native.itemsize > self.cache.maxbytes):
+      return None
+
+    rows = np.empty(len(tracelist), dtype=native)
+    missing = []
+    for i, trace in enumerate(tracelist):
+      row = self.cache.get(('header', trace))
+      if (row is None):
+        missing.append(i)
+      else:
+        rows[i] = row
+
+    if (missing):
+      fetched = self._readHeaderRows(None, tracelist[missing])
+      block = np.empty(len(missing), dtype=native)
+      for name in native.names:
+        block[name] = fetched[name]
+      rows[missing] = block
+      for i in missing:
+        self.cache.put(('header', tracelist[i]), rows[i:i+1].copy())
+
+    if (not (isinstance(traces, slice) or np.iterable(traces))):
+      return rows[0]
+
+    return rows
+
+  def _getIndexedHeaders (self):
+    '''
+    Returns the full native-endian trace header table from the persistent
+    index, building and storing it first if necessary.
+    '''
+
+    native = np.dtype([(name, self.trheaddtype.fields[name][0].newbyteorder('=')) for name in self.trheaddtype.names])
+
+    if ('headers' not in self.index or self.index['headers'].dtype != native):
+      self._maybePrint('Building header index...')
+      index, self.index = self.index, None
+      try:
+        table = self.readTraceHeaders()
+      finally:
+        self.index = index
+      self.index.store('headers', table)
+      self._maybePrint('Complete.\n')
+
+    return self.index['headers']
+
+  # --------------------------------------------------------------------
+
+  def _prefetch (self, traces):
+    '''
+    Advises the kernel to read ahead the records for a trace slice or a
+    sorted array of trace numbers (zero-based).  Only applies to
+    memory-mapped I/O.
+    '''
+
+    self._checkOpen()
+
+    if (not self.usemmap):
+      return
+
+    if isinstance(traces, slice):
+      start, stop, step = traces.indices(self.ntr)
+      runstarts, runstops = np.array([start]), np.array([stop])
+    else:
+      traces = np.unique(self._traceList(traces))
+      if (len(traces) == 0):
+        return
+      runstarts, runstops = self._traceRuns(traces)
+
+    mapped = np.frombuffer(self._fp, dtype=np.uint8)
+    for start, stop in zip(runstarts, runstops):
+      offset = self._calcHeadOffset(start+1, self.ns)
+      _adviseWillNeed(mapped, offset, self._calcHeadOffset(stop+1, self.ns) - offset)
+
+  def _readGather (self, traces, keys=None):
+    '''
+    Reads the header columns and native-endian trace data for a trace
+    slice or array of trace numbers (zero-based).
+    '''
+
+    headers = self._readHeaderColumns(keys, traces, True, False)
+
+    data = np.atleast_2d(self._readBulk(traces, native=True, cached=False))
+
+    return headers, data
+
+  def iter_gathers (self, key='fldr', contiguous=True, keys=None, prefetch=1):
+    '''
+    Iterates over ensembles (e.g., shot, receiver or CDP gathers), yielding
+    the header columns and the traces for each.  While the caller works on
+    one gather, a background thread advises the kernel to read ahead and
+    decodes the next gather(s) into a staging buffer.
+
+    :param key: Key value of trace header that defines the ensembles (uses lower-case SU names; see TRHEADLIST).
+    :type key: str
+    :param contiguous: If True, each contiguous run of traces is an ensemble (see :py:meth:`SEGYFile.calcEnsembles`); otherwise all traces with the same header value are gathered (see :py:meth:`SEGYFile.groupEnsembles`).
+    :type contiguous: bool
+    :param keys: Header names to return for each gather.  Optional; if omitted, all headers are returned.
+    :type keys: list, None
+    :param prefetch: Number of gathers to read ahead.  Zero disables the background thread.
+    :type prefetch: int
+
+    :returns: generator -- yields (headers, traces); *headers* is a dict of header columns and *traces* is a 2D native-endian float32 array
+    '''
+
+    if (contiguous):
+      values, starts, stops = self.calcEnsembles(key)
+      selections = (slice(start, stop) for start, stop in zip(starts, stops))
+    else:
+      values, order, starts, stops = self.groupEnsembles(key)
+      selections = (order[start:stop] for start, stop in zip(starts, stops))
+
+    if (prefetch < 1):
+      for selection in selections:
+        yield self._readGather(selection, keys)
+      return
+
+    staged = Queue.Queue(maxsize=prefetch)
+    stopping = threading.Event()
+
+    def producer ():
+      try:
+        for selection in selections:
+          self._prefetch(selection)
+          item = (None, self._readGather(selection, keys))
+          while not stopping.is_set():
+            try:
+              staged.put(item, timeout=0.1)
+              break
+            except Queue.Full:
+              pass
+          if (stopping.is_set()):
+            return
+      except Exception:
+        # Keep the traceback, so that the error is re-raised as it occurred
+        item = (sys.exc_info(), None)
+      else:
+        item = (None, None)
+
+      while not stopping.is_set():
+        try:
+          staged.put(item, timeout=0.1)
+          break
+        except Queue.Full:
+          pass
+
+    worker = threading.Thread(target=producer)
+    worker.daemon = True
+    worker.start()
+
+    try:
+      while True:
+        error, gather = staged.get()
+        if (error is not None):
+          raise error[0], error[1], error[2]
+        if (gather is None):
+          return
+        yield gather
+    finally:
+      stopping.set()
+
+  def iter_chunks (self, max_bytes=None, ntraces=None, start=0, stop=None, workers=None):
+    '''
+    Iterates over the traces in contiguous blocks of bounded size, so that a
+    whole dataset can be processed with fixed peak memory.  Format
+    conversion is done one block at a time, and the next block is read ahead
+    while the caller works on the current one.
+
+    :param max_bytes: Maximum size in bytes of each (float32) block.  Defaults to 64 MB if neither *max_bytes* nor *ntraces* is given.
+    :type max_bytes: int, None
+    :param ntraces: Maximum number of traces in each block.
+    :type ntraces: int, None
+    :param start: First trace to read (zero-based).
+    :type start: int
+    :param stop: Trace to stop before (zero-based).  Optional; if omitted, reads to the end of the file.
+    :type stop: int, None
+    :param workers: Number of threads used to read and convert each block.  Defaults to :py:attr:`SEGYFile.workers`.
+    :type workers: int, None
+
+    :returns: generator -- yields (index, traces); *index* is the slice of trace numbers covered and *traces* is a 2D native-endian float32 array
+    '''
+
+    if (max_bytes is None and ntraces is None):
+      max_bytes = 64*MEGABYTE
+
+    blocksize = self.ntr
+    if (max_bytes is not None):
+      blocksize = min(blocksize, max_bytes // (4*max(self.ns, 1)))
+    if (ntraces is not None):
+      blocksize = min(blocksize, ntraces)
+    blocksize = max(blocksize, 1)
+
+    start, stop, step = slice(start, stop).indices(self.ntr)
+
+    for first in xrange(start, stop, blocksize):
+      index = slice(first, min(first + blocksize, stop))
+      self._prefetch(slice(index.stop, min(index.stop + blocksize, stop)))
+      yield index, np.atleast_2d(self._readBulk(index, workers, native=True, cached=False))
+
+  # --------------------------------------------------------------------
+
+  @cython.wraparound(False)
+  @cython.boundscheck(False)
+  def readTraces (self, traces=None, workers=None):
+    '''
+    Returns trace data as a list of numpy arrays (i.e. non-adjacent trace
+    numbers are allowed). Requires that traces be fixed length.
+
+    :param traces: List of traces to return, using 1-based trace numbering.  Optional; if omitted, all traces are returned.
+    :type traces: list, None
+    :param workers: Number of threads used to read and convert the traces.  Defaults to :py:attr:`SEGYFile.workers`.
+    :type workers: int, None
+
+    :returns: ndarray -- 2D array containing (possibly non-adjacent) seismic traces
+
+    .. versionchanged:: devel
+    This is now a legacy interface, and is superseded by the __getitem__
+    interface, which uses standard Python slice notation.
+    '''
+
+    if (traces is None):
+      return self._readBulk(slice(None), workers)
+
+    if not np.iterable(traces):
+      return self._readBulk(traces-1, workers)
+    else:
+      return self._readBulk(np.asarray(traces, dtype=np.int64) - 1, workers, native=True)
+
+  def __getitem__ (self, index):
+    '''
+    Returns traces from the open seismic dataset, with support for standard
     Python slice notation.  Trace numbers are zero-based.
 
-    :param index: Slice object or trace number (using zero-based numbering).
-    :type traces: slice object
+    For IEEE floating point (format 5) and SU data, the result is a
+    read-only view over the memory map, in the byte order of the file; no
+    data are copied or byte-swapped.  Use :py:attr:`SEGYFile.native` to get
+    a native-endian copy.
+
+    Arrays of trace numbers (in any order, possibly repeated) and boolean
+    masks are also accepted; these are read as contiguous runs of traces and
+    always return a (new) 2D array.
+
+    A second index selects a window of samples, e.g. sf[traces, s0:s1]; only
+    the samples in the window are read and converted.  With a second index,
+    the shape of the result follows the usual NumPy rules.
+
+    :param index: Slice object, trace number, integer array or boolean mask (using zero-based numbering), optionally followed by a sample number or slice.
+    :type traces: slice object, int, ndarray, tuple
 
     :returns: ndarray -- 2D array containing (possibly non-adjacent) seismic traces
     '''
 
+    return self._readBulk(index)
+
+  def _readBulk (self, index, workers=None, native=False, cached=True):
+    '''
+    Implements :py:meth:`SEGYFile.__getitem__` and :py:attr:`SEGYFile.native`.
+    Large reads of a slice or array of traces are split into pieces that are
+    read and converted concurrently by *workers* threads, into a single
+    preallocated native-endian float32 array.  Small random-access reads go
+    through the cache, unless *cached* is False (e.g., for streaming reads).
+    '''
+
+    if isinstance(index, tuple):
+      if (len(index) != 2):
+        raise IndexError('too many indices')
+      index, samples = index
+      squeeze = False
+    else:
+      samples = None
+      squeeze = not isinstance(index, (list, np.ndarray))
+
+    if (workers is None):
+      workers = self.workers
+
+    conversion = not (self.isSU or self.bhead['format'] == 5)
+
+    result = None
+    if (cached and (native or conversion) and self._cacheable(index)):
+      result = self._readCached(index, samples)
+
+    if (result is None and workers > 1 and (native or conversion) and isinstance(index, (slice, list, np.ndarray))):
+      result = self._readParallel(index, samples, workers)
+
+    if (result is None):
+      result = self._decodeTraces(index, samples)
+      if (native and not conversion):
+        result = np.array(result, dtype=np.float32)
+
+    if (squeeze and result.ndim == 2 and result.shape[0] == 1):
+      result = result[0]
+
+    return result
+
+  def _cacheable (self, index):
+    '''
+    Returns True if a trace index is a small random-access request that
+    should be read through the cache: a trace number, or an array or mask
+    of at most CACHEMAXTRACES traces.  Slices (including strided ones) are
+    read directly from the file.
+    '''
+
+    if (self.cache is None or isinstance(index, slice)):
+      return False
+
+    if isinstance(index, (list, np.ndarray)):
+      index = np.asarray(index)
+      if (index.dtype == np.bool_):
+        return np.count_nonzero(index) <= CACHEMAXTRACES
+      return index.size <= CACHEMAXTRACES
+
+    return True
+
+  def _readCached (self, index, samples):
+    '''
+    Reads whole traces through the cache, converting and caching those that
+    are missing, and then applies the sample index.  Returns None if the
+    request is too large to cache.
+    '''
+
+    traces = self._traceArray(index)
+
+    if (len(traces)*self.ns*4 > self.cache.maxbytes):
+      return None
+
+    block = np.empty((len(traces), self.ns), dtype=np.float32)
+    missing = []
+    for i, trace in enumerate(traces):
+      data = self.cache.get(('trace', trace))
+      if (data is None):
+        missing.append(i)
+      else:
+        block[i] = data
+
+    if (missing):
+      block[missing] = self._decodeTraces(traces[missing])
+      for i in missing:
+        self.cache.put(('trace', traces[i]), block[i].copy())
+
+    if (samples is not None):
+      block = block[:, samples]
+
+    if (not isinstance(index, (slice, list, np.ndarray))):
+      return block[0]
+
+    return block
+
+  def _readParallel (self, index, samples, workers):
+    '''
+    Reads a slice or array of traces into one preallocated float32 array,
+    using a pool of threads that each read and convert contiguous pieces of
+    the request; the GIL is released while reading and converting.  Returns
+    None if the request is too small to be worth splitting.
+    '''
+
     if isinstance(index, slice):
-      indices = index.indices(len(self))
-      traces = range(*indices)
+      start, stop, step = index.indices(self.ntr)
+      traces = xrange(start, stop, step)
     else:
-      traces = [index]
+      traces = self._traceList(index)
 
-    ns = self.ns
+    if (samples is None):
+      shape = (len(traces), self.ns)
+    elif isinstance(samples, slice):
+      shape = (len(traces), len(xrange(*samples.indices(self.ns))))
+    else:
+      self._sampleWindow(samples)
+      shape = (len(traces),)
+
+    if (np.prod(shape) < PARALLELMIN):
+      return None
+
+    result = np.empty(shape, dtype=np.float32)
+
+    npieces = min(len(traces), workers*PARALLELSPLIT)
+    bounds = np.linspace(0, len(traces), npieces+1).astype(np.int64)
+    pieces = Queue.Queue()
+    for i in xrange(npieces):
+      pieces.put((bounds[i], bounds[i+1]))
+
+    errors = []
 
-    result = []
+    def work ():
+      while (not errors):
+        try:
+          first, last = pieces.get_nowait()
+        except Queue.Empty:
+          return
+
+        if isinstance(index, slice):
+          end = start + last*step
+          piece = slice(start + first*step, None if end < 0 else end, step)
+        else:
+          piece = traces[first:last]
+
+        try:
+          self._decodeTraces(piece, samples, result[first:last], parallel=False)
+        except Exception:
+          errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=work) for i in xrange(min(workers, npieces))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    if (errors):
+      raise errors[0][0], errors[0][1], errors[0][2]
+
+    return result
+
+  def _decodeTraces (self, index, samples=None, out=None, parallel=True):
+    '''
+    Reads traces (and optionally a window of samples) and converts them from
+    the trace format of the file.  For IEEE floating point (format 5) and SU
+    data the result is returned in the byte order of the file, as a view if
+    possible.  If *out* is given, native-endian float32 results are written
+    into it instead.
+    '''
+
+    bo = self._dataByteOrder()
 
     # Handles SU format and IEEE floating point
     if (self.isSU or self.bhead['format'] == 5):
-      for trace in traces:
-        if (trace < 0):
-          trace = self.ntr + trace
+      result = self._readTraceData(index, bo + 'f4', samples)
 
-        self._fp.seek(self._calcDataOffset(trace+1, ns))
-        tracetemp = self._fp.read(ns*4)
-        result.append(np.array(struct.unpack('>%df'%(ns,), tracetemp), dtype=np.float32))
+      if (out is not None):
+        out[...] = result
+        return out
 
-    # Handles everything else
-    else:
+      return result
+
+    format = self.bhead['format']
+
+    if (self._isInitialized()):
+      self._maybePrint('FORMAT == %d'%(format,))
+
+    # format == 1: IBM Floating Point
+    if (format == 1):
       if (self._isInitialized()):
-        self._maybePrint('FORMAT == %d'%(self.bhead['format'],))
-
-      # format == 1: IBM Floating Point
-      if (self.bhead['format'] == 1):
-        if (self._isInitialized()):
-          self._maybePrint('             ...converting from IBM floating point.\n')
-        for trace in traces:
-          self._fp.seek(self._calcDataOffset(trace+1, ns))
-          tracetemp = ibm2ieee(self._fp.read(ns*4))
-          result.append(np.array(struct.unpack('>%df'%(ns,), tracetemp), dtype=np.float32))
-
-      elif (self.bhead['format'] == 2):
-        if (self._isInitialized()):
-          self._maybePrint('             ...reading from 32-bit fixed point.\n')
-        for trace in traces:
-          self._fp.seek(self._calcDataOffset(trace+1, ns))
-          result.append(np.array(struct.unpack('>%dl'%(ns,),self._fp.read(ns*4)), dtype=np.int32))
-
-      elif (self.bhead['format'] == 3):
-        if (self._isInitialized()):
-          self._maybePrint('             ...reading from 16-bit fixed point.\n')
-        for trace in traces:
-          self._fp.seek(self._calcDataOffset(trace+1, ns))
-          result.append(np.array(struct.unpack('>%dh'%(ns,),self._fp.read(ns*2)), dtype=np.int32))
-
-      elif (self.bhead['format'] == 8):
-        if (self._isInitialized()):
-          self._maybePrint('             ...reading from 8-bit fixed point.\n')
-        for trace in traces:
-          self._fp.seek(self._calcDataOffset(trace+1, ns))
-          result.append(np.array(struct.unpack('>%db'%(ns,),self._fp.read(ns)), dtype=np.int32))
-
-      elif (self.bhead['format'] == 4):
-        if (self._isInitialized()):
-          self._maybePrint('             ...converting from 32-bit fixed point w/ gain.\n')
-        for trace in traces:
-          self._fp.seek(self._calcDataOffset(trace+1, ns))
-          tracemantissa = np.array(struct.unpack('>%s'%(ns*'xxh',), self._fp.read(ns)), dtype=np.float32)
-          traceexponent = np.array(struct.unpack('>%s'%(ns*'xbxx',), self._fp.read(ns)), dtype=np.byte)
-          result.append(tracemantissa**traceexponent)
+        self._maybePrint('             ...converting from IBM floating point.\n')
+
+      raw = self._readTraceData(index, bo + 'u4', samples)
+      shape = raw.shape
+
+      if (raw.size == 0):
+        result = np.zeros(shape, dtype=np.float32)
       else:
-        raise SEGYFileException('Unrecognized trace format.')
+        raw = np.asarray(raw).reshape((-1, shape[-1] if raw.ndim else 1))
+        if (raw.dtype != np.dtype('>u4') or (raw.shape[1] > 1 and raw.strides[1] != 4)):
+          raw = raw.astype('>u4')
+        if (out is not None):
+          ibm2ieeeBlock(raw, out.reshape(raw.shape), parallel)
+          return out
+        result = ibm2ieeeBlock(raw, None, parallel).reshape(shape)
+
+    elif (format in FORMATDTYPES):
+      code, description = FORMATDTYPES[format]
+      if (self._isInitialized()):
+        self._maybePrint('             ...reading from %s.\n'%(description,))
+      result = self._readTraceData(index, bo + code, samples).astype(np.float32)
 
-    
-    result = np.array(result, dtype=np.float32)
+    elif (format in (7, 15)):
+      if (self._isInitialized()):
+        self._maybePrint('             ...reading from 24-bit fixed point.\n')
+      dtype = np.dtype({'names': ['b0', 'b1', 'b2'], 'formats': ['u1']*3, 'offsets': [0, 1, 2], 'itemsize': 3})
+      raw = self._readTraceData(index, dtype, samples)
+      hi, mid, lo = (raw['b0'], raw['b1'], raw['b2']) if (bo == '>') else (raw['b2'], raw['b1'], raw['b0'])
+      value = (hi.astype(np.int32) << 16) | (mid.astype(np.int32) << 8) | lo
+      if (format == 7):
+        # Sign-extend from 24 bits
+        value = (value << 8) >> 8
+      result = value.astype(np.float32)
+
+    elif (format == 4):
+      if (self._isInitialized()):
+        self._maybePrint('             ...converting from 32-bit fixed point w/ gain.\n')
+      # Byte 0 is zero, byte 1 is the binary gain exponent and bytes 2-3
+      # are the two's complement mantissa; value = mantissa * 2**-gain
+      if (bo == '>'):
+        dtype = np.dtype({'names': ['gain', 'mantissa'], 'formats': ['u1', '>i2'], 'offsets': [1, 2], 'itemsize': 4})
+      else:
+        dtype = np.dtype({'names': ['gain', 'mantissa'], 'formats': ['u1', '<i2'], 'offsets': [2, 0], 'itemsize': 4})
+      raw = self._readTraceData(index, dtype, samples)
+      result = np.ldexp(raw['mantissa'].astype(np.float32), -raw['gain'].astype(np.int32)).astype(np.float32)
+
+    else:
+      raise SEGYFileException('Unrecognized trace format.')
 
-    if (result.shape[0] == 1):
-      result.shape = (result.shape[1],)
+    if (out is not None):
+      out[...] = result
+      return out
 
-    if (self.endian == 'Foreign'):
-      return result.byteswap()
-    else:
-      return result
+    return result
 
   # --------------------------------------------------------------------
 
@@ -594,7 +2425,7 @@ class SEGYFile (object):
 
   def findTraces (self, key, kmin, kmax):
     '''
-    Finds traces whose header values fall within a particular range.  Trace numbers are 1-based, i.e., for use with readTraces.
+    Finds traces whose header values fall within a particular range.  Trace numbers are 1-based, i.e., for use with readTraces.  See :py:meth:`SEGYFile.query` for more general selections.
 
     :param key: Key value of trace header to scan (uses lower-case SU names; see TRHEADLIST.
     :type key: str
@@ -604,43 +2435,162 @@ class SEGYFile (object):
     :type kmax: int
     '''
 
-    if not self.trhead[0].has_key(key):
-      raise SEGYFileException('Invalid trace header: %s'%key)
+    return (self.query(**{key: (kmin, kmax)}) + 1).tolist()
+
+  def query (self, sort=None, group=None, **predicates):
+    '''
+    Selects traces by their trace header values, using vectorized operations
+    on the header columns (see :py:meth:`SEGYFile.readTraceHeaders`).  Each
+    predicate is given as key=condition, and a trace is selected only if all
+    of the predicates hold.  A condition may be:
+
+      * a number: the header must equal it, e.g. trid=1
+      * a tuple (kmin, kmax): the header must be within the range (inclusive), e.g. offset=(0, 2000); either bound may be None
+      * a set, list or array: the header must be one of its values, e.g. fldr=set([101, 102])
+      * a callable: called with the header column, returning a boolean mask
+
+    :param sort: Header name (or list of header names, most significant first) to sort the selected traces by.  Optional; if omitted, traces are returned in file order.  Sorting is stable.
+    :type sort: str, list, None
+    :param group: Header name to group the selected traces by.  Groups are ordered by first appearance, and keep the order of the traces within them.
+    :type group: str, None
+
+    :returns: ndarray, tuple -- zero-based trace numbers; or, if *group* is given, a tuple (values, order, starts, stops) as for :py:meth:`SEGYFile.groupEnsembles`
+    '''
+
+    return _queryHeaders(self, sort, group, predicates)
+
+  def sortedIndex (self, keys):
+    '''
+    Returns a sorted secondary index (see :py:class:`SEGYSortedIndex`) on one
+    or more trace header keys, e.g. sf.sortedIndex(['fldr', 'tracf']), for
+    fast point lookups and vectorized joins.  Each index is built once, and
+    its sort order is kept in the persistent header index, if one is in use.
+
+    :param keys: Header name, or list of header names (most significant first).
+    :type keys: str, list
+
+    :returns: :py:class:`SEGYSortedIndex` instance
+    '''
+
+    if isinstance(keys, basestring):
+      keys = [keys]
+    keys = tuple(keys)
+
+    if (keys in self._sortedindexes):
+      return self._sortedindexes[keys]
+
+    name = 'sorted.%s.order'%(','.join(keys),)
+    columns = self.readTraceHeaders(list(keys), asdict=True)
+
+    order = None
+    if (self.index is not None and name in self.index):
+      order = self.index[name]
 
-    validtraces = []
+    if (order is None):
+      self._maybePrint('Sorting traces by %s...'%(', '.join(keys),))
+      sortedindex = SEGYSortedIndex(keys, columns)
+      if (self.index is not None):
+        self.index.store(name, sortedindex.order)
+      self._maybePrint('Complete.\n')
+    else:
+      sortedindex = SEGYSortedIndex(keys, columns, order)
 
-    for i,trace in enumerate(self.trhead):
-      if (trace[key] <= kmax and trace[key] >= kmin):
-        validtraces.append(i+1)
+    self._sortedindexes[keys] = sortedindex
 
-    return validtraces
+    return sortedindex
 
   # --------------------------------------------------------------------
 
-  def _calcEnsembles (self):
+  def calcEnsembles (self, key='fldr'):
     '''
-    Prototype interface for calculating ensemble boundaries (currently hard-coded to find shot gathers).
+    Finds contiguous runs of traces that share the same value of a trace
+    header (e.g., shot gathers in a shot-sorted file).  Runs in time linear
+    in the number of traces.  Results are kept in the persistent header
+    index, if one is in use.
 
-    *Experimental*
+    :param key: Key value of trace header to scan (uses lower-case SU names; see TRHEADLIST); e.g., 'fldr', 'ep', 'cdp'.
+    :type key: str
+
+    :returns: tuple -- (values, starts, stops); run *i* covers traces starts[i]:stops[i] (zero-based) and has header value values[i]
     '''
 
-    self.ensembles = {}
+    name = 'ensembles.%s'%(key,)
+
+    if (self.index is not None and name + '.values' in self.index):
+      return self.index[name + '.values'], self.index[name + '.starts'], self.index[name + '.stops']
 
     self._maybePrint('Scanning ensembles...')
-    for i in xrange(len(self)):
-      fldr = self.trhead[i]['fldr']
 
-      try:
-        self.ensembles.keys().index(fldr)
+    column = self.readTraceHeaders([key], asdict=True)[key]
+
+    bounds = np.flatnonzero(column[1:] != column[:-1]) + 1
+    starts = np.concatenate(([0], bounds)).astype(np.int64)
+    stops = np.concatenate((bounds, [len(column)])).astype(np.int64)
+
+    if (len(column) == 0):
+      starts = stops = np.zeros((0,), dtype=np.int64)
+
+    values = column[starts]
+
+    self._maybePrint('Complete. Found %d contiguous ensemble(s).\n'%(len(values),))
+
+    if (self.index is not None):
+      self.index.store(name + '.values', values)
+      self.index.store(name + '.starts', starts)
+      self.index.store(name + '.stops', stops)
+
+    return values, starts, stops
+
+  def groupEnsembles (self, key='fldr'):
+    '''
+    Groups traces by the value of a trace header, whether or not the traces
+    in each group are contiguous in the file (e.g., receiver gathers in a
+    shot-sorted file).  Groups are ordered by first appearance, and traces
+    within each group are kept in file order.
+
+    :param key: Key value of trace header to scan (uses lower-case SU names; see TRHEADLIST).
+    :type key: str
+
+    :returns: tuple -- (values, order, starts, stops); group *i* has header value values[i] and consists of traces order[starts[i]:stops[i]] (zero-based)
+    '''
+
+    runvalues, runstarts, runstops = self.calcEnsembles(key)
+    runlengths = runstops - runstarts
+
+    uvalues, first, inverse = np.unique(runvalues, return_index=True, return_inverse=True)
+
+    # Renumber groups by order of first appearance
+    rank = np.argsort(first, kind='mergesort')
+    groupnum = np.empty_like(rank)
+    groupnum[rank] = np.arange(len(rank))
+    rungroup = groupnum[inverse]
+
+    # Stable sort of runs (not traces) by group, then expand runs to traces
+    runorder = np.argsort(rungroup, kind='mergesort')
+    lengths = runlengths[runorder]
+    outstarts = np.cumsum(lengths) - lengths
+    order = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(runstarts[runorder] - outstarts, lengths)
+
+    counts = np.bincount(rungroup, weights=runlengths, minlength=len(rank)).astype(np.int64)
+    stops = np.cumsum(counts)
+    starts = stops - counts
 
-      except ValueError:
-        self.ensembles[fldr] = i
+    return uvalues[rank], order, starts, stops
+
+  def _calcEnsembles (self):
+    '''
+    Legacy interface for calculating shot-gather boundaries; sets
+    :py:attr:`SEGYFile.ensembles` to map each *fldr* value to its first
+    trace number.  See :py:meth:`SEGYFile.calcEnsembles` and
+    :py:meth:`SEGYFile.groupEnsembles`.
+    '''
+
+    values, order, starts, stops = self.groupEnsembles('fldr')
+    self.ensembles = dict(zip(values.tolist(), order[starts].tolist()))
 
-    self._maybePrint('Complete. Found %d ensemble(s).\n'%(len(self.ensembles),))
-       
   # --------------------------------------------------------------------
 
-  def __init__ (self, filename, verbose = None, majorheadersonly = None, isSU = None, endian = None, usemmap = None, extraheaders = None):
+  def __init__ (self, filename, verbose = None, majorheadersonly = None, isSU = None, endian = None, usemmap = None, extraheaders = None, useindex = None, lazy = None, workers = None, cachebytes = None, writable = None):
 
     self.filename = os.path.abspath(filename)
 
@@ -654,11 +2604,26 @@ class SEGYFile (object):
       self.isSU = isSU
 
     if (endian is not None):
-      self.endian = endian
+      self._endian = endian
 
     if (usemmap is not None):
       self.usemmap = usemmap
 
+    if (useindex is not None):
+      self.useindex = useindex
+
+    if (lazy is not None):
+      self.lazy = lazy
+
+    if (workers is not None):
+      self.workers = workers
+
+    if (cachebytes is not None):
+      self.cachebytes = cachebytes
+
+    if (writable is not None):
+      self.writable = writable
+
     if (extraheaders is not None):
       augment = extraheaders
     else:
@@ -670,11 +2635,11 @@ class SEGYFile (object):
 
     self.filesize = os.path.getsize(filename)
 
-    fp = open(self.filename, 'r+b')
+    fp = open(self.filename, 'r+b' if self.writable else 'rb')
     if (self.usemmap):
       try:
         self._maybePrint('Trying to create memory map...')
-        self._fp = mmap.mmap(fp.fileno(), 0, flags=mmap.MAP_PRIVATE)
+        self._fp = mmap.mmap(fp.fileno(), 0, flags=mmap.MAP_SHARED if self.writable else mmap.MAP_PRIVATE)
         self._maybePrint('Success. Using memory-mapped I/O.\n')
         fp.close()
       except:
@@ -689,39 +2654,118 @@ class SEGYFile (object):
     # Get header information from file
     self._readHeaders()
 
+    # The rev2 byte-order word also gives the byte order of the data
+    if (self.headerorder is not None and endian in (None, 'Auto')):
+      self._endian = 'Big' if (self.headerorder == '>') else 'Little'
+      self._endianconfidence = 1.
+
+    # Open (or prepare to rebuild) the persistent header index
+    if (self.useindex):
+      self.index = SEGYIndex(self)
+
+    # Find the trace boundaries, if the traces have different lengths
+    self._checkTraceLengths()
+
+    if (self.cachebytes):
+      self.cache = SEGYCache(self.cachebytes)
+
+    self._sortedindexes = {}
+
     # Determine length of each sample from FORMAT code
     #self._getSamplen()
 
     # Attempt to find shot-record boundaries
     #self._calcEnsembles()
 
-    # Autodetect data endian
-    self._detectFileEndian()
+    # Autodetect data endian (on first use, if lazy)
+    self._endianlock = threading.Lock()
+    if (self.lazy):
+      self._endianpending = True
+    else:
+      self._detectFileEndian()
 
     # Confirm that the SEGYFile object has been initialized
     self.initialized = True
   
   # --------------------------------------------------------------------
 
-  def __del__ (self):
-    self._fp.close()
+  # There is no __del__: SEGYFile is part of reference cycles (e.g., with
+  # trhead and native), which Python 2 never collects if they define one.
+  # Use close() (or a with statement) to release the file promptly;
+  # otherwise it is closed when the collector frees it.
+
+  def close (self):
+    '''
+    Closes the datafile, the memory map and the persistent index.  Trace
+    views already returned by :py:meth:`SEGYFile.__getitem__` remain valid;
+    if any are still in use, the memory map is unmapped when the last of
+    them is released.  The instance cannot be read after closing.  Calling
+    close more than once has no effect.
+    '''
+
+    if (self._fp is None):
+      return
+
+    fp, self._fp = self._fp, None
+
+    if (self.usemmap):
+      if (self.writable):
+        fp.flush()
+      # Python 2 memory maps do not track the arrays that view them, so the
+      # map is not closed explicitly; it is unmapped (and its file closed)
+      # as soon as the last reference to it, here or in a view, is dropped
+      del fp
+    else:
+      fp.close()
+
+    self.index = None
+    self._sortedindexes = {}
+    if (self.cache is not None):
+      self.cache.clear()
+
+  def _checkOpen (self):
+    '''
+    Raises an exception if the datafile has been closed.
+    '''
+
+    if (self._fp is None):
+      raise SEGYFileException('I/O operation on closed datafile: %s'%(self.filename,))
+
+  @property
+  def closed (self):
+    '''
+    True if the datafile has been closed (see :py:meth:`SEGYFile.close`).
+    '''
+
+    return self._fp is None
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, exc_type, exc_value, traceback):
+    self.close()
 
   # --------------------------------------------------------------------
 
   def _getSamplen (self):
     if (self.isSU):
       self.samplen = 4
-      self.ntr = (self.filesize) / (240 + self.samplen*self.ns)
+      self.ntr = (self.databytes) / (240 + self.samplen*self.ns)
       return
 
-    if (self.bhead['format'] == 3):
-      self.samplen = 2
-    elif (self.bhead['format'] == 8):
-      self.samplen = 1
+    format = self.bhead['format']
+    if (format in FORMATDTYPES):
+      self.samplen = np.dtype(FORMATDTYPES[format][0]).itemsize
+    elif (format in (7, 15)):
+      self.samplen = 3
     else:
       self.samplen = 4
 
-    self.ntr = (self.filesize - 3600) / (240 + self.samplen*self.ns)
+    self.ntr = max(self.databytes, 0) / (240 + self.samplen*self.ns)
+
+    # The rev2 trace count, if given, excludes anything after the traces
+    if (self.bhead['revmajor'] >= 2 and 0 < self.bhead['ntrfile'] < self.ntr):
+      self.ntr = self.bhead['ntrfile']
 
   # --------------------------------------------------------------------
 
@@ -762,23 +2806,43 @@ class SEGYFile (object):
     fp_out = open(outfilename, "w")
 
     for trace in xrange(1, ntraces+1):
-      self._fp.seek(self._calcDataOffset(trace,ns))
-      fp_out.write(self._fp.read(ns*4))
+      fp_out.write(self._readAt(self._calcDataOffset(trace,ns), ns*4))
 
     fp_out.close()
 
   # --------------------------------------------------------------------
 
+  def _headerBlock (self, trhead, index):
+    '''
+    Returns the trace headers for a slice of traces as a structured array,
+    from a :py:class:`SEGYTraceHeader`, a structured array, or a list of
+    dictionaries.
+    '''
+
+    if isinstance(trhead, SEGYTraceHeader):
+      return trhead.sf.readTraceHeaders(traces=index)
+
+    if isinstance(trhead, np.ndarray):
+      return trhead[index]
+
+    rows = list(trhead[index])
+    names = [name for name in self.trheaddtype.names if (len(rows) == 0 or name in rows[0])]
+    native = np.dtype([(name, self.trheaddtype.fields[name][0].newbyteorder('=')) for name in names])
+
+    return np.array([tuple(row[name] for name in names) for row in rows], dtype=native)
+
   def writeSEGY (self, outfilename, traces, headers=None):
     '''
     Outputs seismic traces in a new SEG-Y file, optionally using the headers
-    from the existing dataset.
+    from the existing dataset.  Traces are written in IBM floating point if
+    the binary header specifies format 1, and in IEEE floating point
+    otherwise.  See also :py:class:`SEGYWriter`.
 
     :param outfilename: Filename for new SEG-Y datafile.
     :type outfilename: str
     :param traces: Array of seismic traces to output.
     :type traces: ndarray, list
-    :param headers: List of three headers: [thead, bhead, trhead].  If omitted, the existing headers in the SEGYFile instance are used. *thead* is an ASCII-formatted 3200-byte text header. *bhead* is a list of binary header values similar to SEGYFile.bhead.  *trhead* is a list or list-like object of trace header values.
+    :param headers: List of three headers: [thead, bhead, trhead].  If omitted, the existing headers in the SEGYFile instance are used. *thead* is an ASCII-formatted 3200-byte text header. *bhead* is a list of binary header values similar to SEGYFile.bhead.  *trhead* is a list or list-like object of trace header values, or a structured array such as returned by :py:meth:`SEGYFile.readTraceHeaders`.
     :type headers: list, None
     '''
 
@@ -789,57 +2853,206 @@ class SEGYFile (object):
     else:
       [thead, bhead, trhead] = headers
 
+    traces = np.atleast_2d(np.asarray(traces))
     ntraces = len(traces)
 
-    ns = self.ns
-
-    fp = open(outfilename, 'w+b')
-
-    fp.write(thead.encode('IBM500')[:3200])
-    
-    bheadbin = struct.pack(BHEADSTRUCT, *[bhead[key] for key in BHEADLIST]) + '\x00' * 340
-
-    fp.write(bheadbin)
+    format = 1 if (bhead['format'] == 1) else 5
 
-    for i, trace in enumerate(traces):
-      trheadbin = struct.pack(self.trheadstruct, *[trhead[i][key] for key in self.trheadlist]) + '\x00' * 60
-      fp.write(trheadbin)
-      tracetemp = struct.pack('>%df'%(ns,), *list(trace))
-      fp.write(tracetemp)
-
-    fp.close()
+    with SEGYWriter(outfilename, traces.shape[1], format=format, thead=thead, bhead=bhead, trheaddtype=self.trheaddtype) as writer:
+      for first in xrange(0, ntraces, WRITEBLOCK):
+        index = slice(first, min(first + WRITEBLOCK, ntraces))
+        writer.write(self._headerBlock(trhead, index), traces[index])
 
   # --------------------------------------------------------------------
 
   def writeSU (self, outfilename, traces, trhead=None):
     '''
     Outputs seismic traces in a new CWP SU file, optionally using the headers
-    from the existing dataset.
+    from the existing dataset.  See also :py:class:`SEGYWriter`.
 
     :param outfilename: Filename for new SU datafile.
     :type outfilename: str
     :param traces: Array of seismic traces to output.
     :type traces: ndarray, list
-    :param trhead: List or list-like object of trace header values.  If omitted, the existing headers in the SEGYFile instance are used.
+    :param trhead: List or list-like object of trace header values, or a structured array such as returned by :py:meth:`SEGYFile.readTraceHeaders`.  If omitted, the existing headers in the SEGYFile instance are used.
     :type trhead: list, None
     '''
 
-    if (trhead == None):
+    if (trhead is None):
       trhead=self.trhead
 
+    traces = np.atleast_2d(np.asarray(traces))
     ntraces = len(traces)
 
-    ns = self.ns
+    with SEGYWriter(outfilename, traces.shape[1], isSU=True, trheaddtype=self.trheaddtype) as writer:
+      for first in xrange(0, ntraces, WRITEBLOCK):
+        index = slice(first, min(first + WRITEBLOCK, ntraces))
+        writer.write(self._headerBlock(trhead, index), traces[index])
+
+  # --------------------------------------------------------------------
+
+  def writeSorted (self, outfilename, keys, max_bytes=None):
+    '''
+    Writes a copy of the dataset (SEG-Y or SU, as the input) with the traces
+    sorted by one or more trace header keys, e.g. ['gx'] for common-receiver
+    order or ['cdp', 'offset'] for CDP order.  Trace records are copied
+    unchanged, and traces with equal keys keep their original order.
 
-    fp = open(outfilename, 'w+b')
+    Datasets larger than memory are sorted externally: the input is read in
+    sequential chunks, each of which is sorted into a run in a temporary
+    file (in the output directory); the runs are then merged, reading each
+    run sequentially and writing the output sequentially.
 
-    for i, trace in enumerate(traces):
-      trheadbin = struct.pack(self.trheadstruct, *[trhead[i][key] for key in self.trheadlist]) + '\x00' * 60
-      fp.write(trheadbin)
-      tracetemp = struct.pack('>%df'%(ns,), *list(trace))
-      fp.write(tracetemp)
+    :param outfilename: Filename for the sorted datafile.
+    :type outfilename: str
+    :param keys: Header name, or list of header names (most significant first).
+    :type keys: str, list
+    :param max_bytes: Approximate bound on the memory used for trace records.  Defaults to 256 MB.
+    :type max_bytes: int, None
+    '''
+
+    if (self.traceoffsets is not None):
+      raise SEGYFileException('Sorting requires traces with the same number of samples.')
+
+    if (max_bytes is None):
+      max_bytes = 256*MEGABYTE
+
+    order = self.sortedIndex(keys).order
+    ntr = self.ntr
+    reclen = self.ns*self.samplen + 240
+    first = self._calcHeadOffset(1, self.ns)
+    recdtype = np.dtype('V%d'%(reclen,))
+
+    # Each chunk is held twice while it is being reordered
+    blocksize = max(max_bytes // (2*reclen), 1)
+
+    # Position of each input trace in the output
+    rank = np.empty_like(order)
+    rank[order] = np.arange(ntr, dtype=np.int64)
+
+    # SEG-Y rev2 trailer records are copied after the traces
+    trailer = ''
+    if (not self.isSU and self.bhead['revmajor'] >= 2 and self.bhead['ntrailer'] > 0):
+      trailer = self._readAt(self.dataoffset + self.databytes, self.filesize - self.dataoffset - self.databytes)
+
+    with open(outfilename, 'wb') as out:
+      out.write(self._readAt(0, first))
+
+      if (ntr <= blocksize):
+        records = np.frombuffer(self._readAt(first, ntr*reclen), dtype=recdtype)
+        records[order].tofile(out)
+        out.write(trailer)
+        return
+
+      fd, runfilename = tempfile.mkstemp(prefix='.pygeosort', dir=os.path.dirname(os.path.abspath(outfilename)))
+      try:
+        with os.fdopen(fd, 'w+b') as runs:
+          self._maybePrint('Sorting %d chunk(s) of up to %d traces...'%(-(-ntr // blocksize), blocksize))
+
+          # Sorted runs, one per chunk of input traces
+          for start in xrange(0, ntr, blocksize):
+            stop = min(start + blocksize, ntr)
+            records = np.frombuffer(self._readAt(first + start*reclen, (stop - start)*reclen), dtype=recdtype)
+            records[np.argsort(rank[start:stop])].tofile(runs)
+          runs.flush()
+
+          self._maybePrint('Merging...')
+
+          # Each output block takes the next few records from each run
+          runof = order // blocksize
+          cursors = np.arange(0, ntr, blocksize, dtype=np.int64)
+
+          for start in xrange(0, ntr, blocksize):
+            stop = min(start + blocksize, ntr)
+            blockruns = runof[start:stop]
+            sorter = np.argsort(blockruns, kind='mergesort')
+            counts = np.bincount(blockruns, minlength=len(cursors))
+
+            block = np.empty((stop - start,), dtype=recdtype)
+            pos = 0
+            for run in np.flatnonzero(counts):
+              count = counts[run]
+              buf = _pread(runs.fileno(), count*reclen, cursors[run]*reclen)
+              block[sorter[pos:pos+count]] = np.frombuffer(buf, dtype=recdtype)
+              cursors[run] += count
+              pos += count
+
+            block.tofile(out)
+
+          out.write(trailer)
+          self._maybePrint('Complete.\n')
+      finally:
+        os.remove(runfilename)
+
+  def extract (self, outfilename, traces, headers=None):
+    '''
+    Writes a subset of the traces (e.g., a range of shots, or every n-th
+    trace) to a new file, copying each trace record (header and samples)
+    byte-for-byte rather than decoding and re-encoding the samples.  The
+    text, binary and any extended text headers are copied, with the rev2
+    trace count updated.  Runs of consecutive traces are copied in a single
+    operation, within the kernel where the platform allows (copy_file_range
+    or sendfile), so that extraction is limited by I/O.
+
+    :param outfilename: Filename for the new datafile.
+    :type outfilename: str
+    :param traces: Slice object, integer array or boolean mask of traces to copy (using zero-based numbering), in output order.
+    :type traces: slice object, ndarray
+    :param headers: New values of trace headers in the output, as a dict mapping header names to a single value or one value per output trace.  Optional; if omitted, the trace headers are copied unchanged.
+    :type headers: dict, None
+    '''
+
+    self._checkOpen()
 
-    fp.close()
+    traces = self._traceArray(traces)
+    ntraces = len(traces)
+
+    checked = []
+    if (headers is not None):
+      for key, values in headers.iteritems():
+        checked.append(self._checkHeaderValues(key, values))
+
+    first = self._calcHeadOffset(1, self.ns)
+    header = bytearray(self._readAt(0, first))
+
+    # SEG-Y rev2 trace count (bytes 3513-3520) and trailer count (bytes
+    # 3529-3532); trailer records are not copied
+    if (not self.isSU and self.bhead['revmajor'] >= 2):
+      order = self.headerorder or '>'
+      struct.pack_into(order + 'Q', header, 3512, ntraces)
+      struct.pack_into(order + 'l', header, 3528, 0)
+
+    if (self.traceoffsets is not None):
+      lengths = np.diff(self.traceoffsets)[traces]
+    else:
+      lengths = np.full((ntraces,), self.ns*self.samplen + 240, dtype=np.int64)
+
+    if (ntraces > 0):
+      starts, stops = self._traceRuns(traces)
+      runoffsets = np.array([self._calcHeadOffset(start+1, self.ns) for start in starts], dtype=np.int64)
+      runlengths = np.array([self._calcHeadOffset(stop+1, self.ns) for stop in stops], dtype=np.int64) - runoffsets
+    else:
+      runoffsets = runlengths = np.empty((0,), dtype=np.int64)
+
+    self._maybePrint('Copying %d trace(s) in %d run(s)...'%(ntraces, len(runoffsets)))
+
+    with open(self.filename, 'rb') as src:
+      with open(outfilename, 'wb') as out:
+        out.write(header)
+        out.flush()
+        _copyRuns(out.fileno(), src.fileno(), runoffsets, runlengths)
+
+    if (checked and ntraces > 0):
+      outoffsets = len(header) + np.cumsum(lengths) - lengths
+      mapped = np.memmap(outfilename, dtype=np.uint8, mode='r+')
+      for fieldtype, fieldoffset, values in checked:
+        packed = np.empty((ntraces,), dtype=fieldtype)
+        packed[...] = values
+        mapped[(outoffsets + fieldoffset)[:, np.newaxis] + np.arange(fieldtype.itemsize)] = packed.view(np.uint8).reshape((-1, fieldtype.itemsize))
+      mapped.flush()
+      del mapped
+
+    self._maybePrint('Complete.\n')
 
   # --------------------------------------------------------------------
 
@@ -865,3 +3078,460 @@ class SEGYFile (object):
 
   def __iter__ (self):
     return self.SIter(self)
+
+# ------------------------------------------------------------------------
+
+class SEGYDataset (object):
+  '''
+  Presents a list of SEG-Y (or SU) files as one logical sequence of traces,
+  numbered globally in the order of the files.  Files are opened (and
+  memory-mapped) when first needed, and at most *maxopen* of them are kept
+  open at once.  Header columns are read from every file once and kept in
+  memory, so that queries and sorts cover the whole dataset without
+  concatenating the files on disk.
+
+  :param filenames: List of datafiles, or a glob pattern (expanded in sorted order).
+  :type filenames: list, str
+  :param maxopen: Maximum number of files kept open at once.  Default DATASETMAXOPEN.
+  :type maxopen: int
+  :param sfopts: Other keyword arguments are passed to :py:class:`SEGYFile` (e.g., isSU, endian, useindex, workers).
+
+  :returns: :py:class:`SEGYDataset` instance
+
+  :var filenames: *list* -- the datafiles, in order.
+  :var starts: *ndarray* -- global number of the first trace in each file, followed by the total number of traces.
+  :var filens: *ndarray* -- number of samples per trace in each file.
+  :var ns: *int* -- largest number of samples per trace; traces from files with fewer samples are zero-padded.
+  :var ntr: *int* -- total number of traces.
+  :var trheaddtype: *dtype* -- trace header layout (from the first file).
+  '''
+
+  def __init__ (self, filenames, maxopen=None, **sfopts):
+
+    if isinstance(filenames, basestring):
+      filenames = sorted(glob.glob(filenames))
+
+    self.filenames = list(filenames)
+    if (len(self.filenames) == 0):
+      raise SEGYFileException('No datafiles given.')
+
+    self.maxopen = max(DATASETMAXOPEN if (maxopen is None) else maxopen, 1)
+    self.sfopts = {'lazy': True}
+    self.sfopts.update(sfopts)
+
+    self._open = collections.OrderedDict()
+    self._pins = {}
+    self._lock = threading.Lock()
+    self._columns = {}
+    self._sortedindexes = {}
+
+    counts = np.empty((len(self.filenames),), dtype=np.int64)
+    self.filens = np.empty((len(self.filenames),), dtype=np.int64)
+    for i in xrange(len(self.filenames)):
+      with self.useFile(i) as sf:
+        counts[i] = sf.ntr
+        self.filens[i] = sf.ns
+        if (i == 0):
+          self.trheaddtype = sf.trheaddtype
+
+    self.starts = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    self.ntr = int(self.starts[-1])
+    self.ns = int(self.filens.max())
+
+  def __len__ (self):
+    return self.ntr
+
+  def close (self):
+    '''
+    Closes all open datafiles (see :py:meth:`SEGYFile.close`), except any
+    that another thread is reading (see :py:meth:`SEGYDataset.useFile`).
+    Files are reopened if traces are read afterwards.
+    '''
+
+    with self._lock:
+      self._evict(0)
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, exc_type, exc_value, traceback):
+    self.close()
+
+  def getFile (self, fileid):
+    '''
+    Returns the :py:class:`SEGYFile` for one of the datafiles, opening it if
+    necessary (and closing the least recently used file, if *maxopen* files
+    are already open).  The instance is closed when it is evicted, which
+    another thread may cause at any time; use :py:meth:`SEGYDataset.useFile`
+    to keep it open while reading from it.
+
+    :param fileid: Position of the file in *filenames*.
+    :type fileid: int
+
+    :returns: :py:class:`SEGYFile` instance
+    '''
+
+    return self._acquire(fileid, False)
+
+  @contextlib.contextmanager
+  def useFile (self, fileid):
+    '''
+    Returns a context manager that opens one of the datafiles (as for
+    :py:meth:`SEGYDataset.getFile`) and keeps it open until the with block
+    ends, e.g. ``with ds.useFile(3) as sf: ...``.  A file in use is never
+    evicted, even if other threads open more than *maxopen* files
+    meanwhile; any files over the limit are closed as they are released.
+
+    :param fileid: Position of the file in *filenames*.
+    :type fileid: int
+
+    :returns: context manager -- yields the :py:class:`SEGYFile` instance
+    '''
+
+    sf = self._acquire(fileid, True)
+    try:
+      yield sf
+    finally:
+      with self._lock:
+        self._pins[fileid] -= 1
+        if (self._pins[fileid] == 0):
+          del self._pins[fileid]
+        self._evict(self.maxopen)
+
+  def _acquire (self, fileid, pin):
+    '''
+    Returns the open SEGYFile for a datafile, opening it (and evicting the
+    least recently used unpinned file) if necessary; optionally pins it.
+    '''
+
+    with self._lock:
+      sf = self._open.pop(fileid, None)
+      if (sf is None):
+        self._evict(self.maxopen - 1)
+        sf = SEGYFile(self.filenames[fileid], **self.sfopts)
+      self._open[fileid] = sf
+      if (pin):
+        self._pins[fileid] = self._pins.get(fileid, 0) + 1
+
+    return sf
+
+  def _evict (self, limit):
+    '''
+    Closes the least recently used files that are not pinned (in use by
+    useFile), until at most *limit* remain open.  Requires the lock.
+    '''
+
+    for fileid in list(self._open):
+      if (len(self._open) <= limit):
+        break
+      if (fileid not in self._pins):
+        self._open.pop(fileid).close()
+
+  def locate (self, traces):
+    '''
+    Maps global trace numbers to file positions and trace numbers within
+    each file (zero-based).
+
+    :param traces: Global trace number(s).
+    :type traces: int, ndarray
+
+    :returns: tuple -- (file positions, local trace numbers)
+    '''
+
+    traces = np.asarray(traces, dtype=np.int64)
+    fileids = np.searchsorted(self.starts, traces, side='right') - 1
+
+    return fileids, traces - self.starts[fileids]
+
+  def _traceArray (self, index):
+    '''
+    Converts a trace index (slice, integer array or boolean mask) into a
+    validated array of non-negative global trace numbers.
+    '''
+
+    if isinstance(index, slice):
+      return np.arange(*index.indices(self.ntr), dtype=np.int64)
+
+    index = np.asarray(index)
+
+    if (index.dtype == np.bool_):
+      if (index.shape != (self.ntr,)):
+        raise IndexError('boolean index must have one entry per trace')
+      return np.flatnonzero(index).astype(np.int64)
+
+    index = index.astype(np.int64).ravel()
+    index = np.where(index < 0, index + self.ntr, index)
+    if (len(index) > 0 and (index.min() < 0 or index.max() >= self.ntr)):
+      raise IndexError('trace index out of range')
+
+    return index
+
+  def _splitByFile (self, traces):
+    '''
+    Splits an array of global trace numbers by file, and yields the file
+    position, the positions in *traces* and the local trace index for each
+    file; contiguous runs of traces are given as slices.
+    '''
+
+    fileids, local = self.locate(traces)
+    order = np.argsort(fileids, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(fileids[order])) + 1
+
+    for positions in np.split(order, bounds):
+      if (len(positions) == 0):
+        continue
+      piece = local[positions]
+      if (piece[-1] - piece[0] == len(piece) - 1 and (len(piece) == 1 or (np.diff(piece) == 1).all())):
+        piece = slice(int(piece[0]), int(piece[-1]) + 1)
+      yield fileids[positions[0]], positions, piece
+
+  def __getitem__ (self, index):
+    '''
+    Returns native-endian float32 traces by global trace number.  The index
+    may be a trace number, slice, integer array or boolean mask, optionally
+    followed by a sample index, e.g. ds[100:5000, 0:500]; slices may cross
+    file boundaries.
+    '''
+
+    if isinstance(index, tuple):
+      if (len(index) != 2):
+        raise IndexError('too many indices')
+      index, samples = index
+    else:
+      samples = slice(None)
+
+    squeeze = not isinstance(index, (slice, list, np.ndarray))
+    traces = self._traceArray([index] if squeeze else index)
+
+    width = np.empty((0, self.ns), dtype=np.float32)[:, samples].shape[1:]
+    result = np.empty((len(traces),) + width, dtype=np.float32)
+
+    for fileid, positions, piece in self._splitByFile(traces):
+      with self.useFile(fileid) as sf:
+        if (sf.ns == self.ns):
+          result[positions] = sf.native[piece, samples]
+        else:
+          block = np.zeros((len(positions), self.ns), dtype=np.float32)
+          block[:, :sf.ns] = sf.native[piece, :]
+          result[positions] = block[:, samples]
+
+    if (squeeze):
+      return result[0]
+
+    return result
+
+  def readTraceHeaders (self, keys=None, traces=None, asdict=False):
+    '''
+    Returns trace headers as columns, as for
+    :py:meth:`SEGYFile.readTraceHeaders`, by global trace number.  The first
+    request for a header reads its column from every file; the unified
+    column is then kept for later requests.
+
+    :param keys: Header names to return.  Optional; if omitted, all headers are returned.
+    :type keys: list, None
+    :param traces: Slice object, trace number or array of global trace numbers.  Optional; if omitted, all traces are returned.
+    :type traces: slice object, int, ndarray, None
+    :param asdict: Return a dictionary of 1D arrays rather than a structured array.
+    :type asdict: bool
+
+    :returns: ndarray, dict -- native-endian structured array (or dict of arrays) with one entry per trace
+    '''
+
+    if (keys is None):
+      keys = list(self.trheaddtype.names)
+
+    for key in keys:
+      if (key not in self.trheaddtype.fields):
+        raise SEGYFileException('Invalid trace header: %s'%key)
+
+    missing = [key for key in keys if key not in self._columns]
+    if (missing):
+      parts = []
+      for i in xrange(len(self.filenames)):
+        with self.useFile(i) as sf:
+          parts.append(sf.readTraceHeaders(missing, asdict=True))
+      for key in missing:
+        self._columns[key] = np.concatenate([part[key] for part in parts])
+
+    if (traces is None):
+      traces = slice(None)
+
+    if (asdict):
+      return dict((key, np.array(self._columns[key][traces])) for key in keys)
+
+    native = np.dtype([(key, self._columns[key].dtype) for key in keys])
+    result = np.empty(np.shape(self._columns[keys[0]][traces]), dtype=native)
+    for key in keys:
+      result[key] = self._columns[key][traces]
+
+    return result
+
+  def query (self, sort=None, group=None, **predicates):
+    '''
+    Selects traces by their trace header values, across all of the files;
+    see :py:meth:`SEGYFile.query`.
+
+    :returns: ndarray, tuple -- global trace numbers; or, if *group* is given, a tuple (values, order, starts, stops)
+    '''
+
+    return _queryHeaders(self, sort, group, predicates)
+
+  def sortedIndex (self, keys):
+    '''
+    Returns a sorted secondary index (see :py:class:`SEGYSortedIndex`) on one
+    or more trace header keys, over global trace numbers.
+
+    :param keys: Header name, or list of header names (most significant first).
+    :type keys: str, list
+
+    :returns: :py:class:`SEGYSortedIndex` instance
+    '''
+
+    if isinstance(keys, basestring):
+      keys = [keys]
+    keys = tuple(keys)
+
+    if (keys not in self._sortedindexes):
+      self._sortedindexes[keys] = SEGYSortedIndex(keys, self.readTraceHeaders(list(keys), asdict=True))
+
+    return self._sortedindexes[keys]
+
+# ------------------------------------------------------------------------
+
+class SEGYWriter (object):
+  '''
+  Writes a new SEG-Y or SU dataset incrementally, in blocks of traces.  Each
+  block of trace headers and samples is packed into a single array of trace
+  records with vectorized byte-swapping (and IBM conversion, if required),
+  and written with one call.
+
+  :param filename: The system path of the datafile to create.
+  :type filename: str
+  :param ns: Number of samples in each trace.
+  :type ns: int
+  :param format: Sample format for SEG-Y output; 1 (IBM floating point) or 5 (IEEE floating point).  SU output is always IEEE.
+  :type format: int
+  :param isSU: Write a Seismic Unix variant file, without the 3200-byte text header and 400-byte binary header.
+  :type isSU: bool
+  :param thead: ASCII text header; converted to EBCDIC and padded or truncated to 3200 bytes.  Optional.
+  :type thead: str, None
+  :param bhead: Binary header values, similar to SEGYFile.bhead.  Missing values are written as zero; *format* and *hns* are set from the arguments.  Optional.
+  :type bhead: dict, None
+  :param trheaddtype: Trace header layout, e.g. SEGYFile.trheaddtype.  Optional; defaults to the standard layout in TRHEADDICT.
+  :type trheaddtype: dtype, None
+  :param bufsize: Size of the output file buffer in bytes.
+  :type bufsize: int
+
+  :returns: :py:class:`SEGYWriter` instance
+
+  :var ntr: *int* -- number of traces written so far.
+  '''
+
+  def __init__ (self, filename, ns, format=5, isSU=False, thead=None, bhead=None, trheaddtype=None, bufsize=16*MEGABYTE):
+
+    if (format not in (1, 5)):
+      raise SEGYFileException('SEGYWriter supports formats 1 (IBM) and 5 (IEEE).')
+
+    self.filename = filename
+    self.ns = ns
+    self.isSU = isSU
+    self.format = 5 if isSU else format
+    self.ntr = 0
+
+    if (trheaddtype is None):
+      trheaddtype = _traceHeaderDtype(TRHEADDICT)
+    self.trheaddtype = trheaddtype.newbyteorder('>')
+
+    self.recdtype = np.dtype([('header', 'V240'), ('data', '>u4' if self.format == 1 else '>f4', (ns,))])
+
+    self._fp = open(filename, 'wb', bufsize)
+
+    if (not isSU):
+      if (thead is None):
+        thead = ''
+      textheader = thead.encode('IBM500')[:3200]
+      textheader += ' '.encode('IBM500') * (3200 - len(textheader))
+
+      values = dict((key, 0) for key in BHEADLIST + BHEADREV2LIST)
+      if (bhead is not None):
+        values.update(bhead)
+      values['format'] = self.format
+      values['hns'] = ns
+
+      # No extended text headers, trailers or additional trace headers are
+      # written; more than 65535 samples need the rev2 extended count
+      for key in ('ntexthead', 'ntrhead', 'firsttrace', 'ntrailer', 'ntrfile'):
+        values[key] = 0
+      values['byteorder'] = BYTEORDERWORD
+      values['extns'] = ns
+      values['trflag'] = 1
+      if (ns > 0xFFFF):
+        values['hns'] = 0
+        values['revmajor'], values['revminor'] = 2, 0
+
+      try:
+        blockheader = struct.pack(BHEADSTRUCT, *[values[key] for key in BHEADLIST])
+        blockheader += struct.pack('>' + BHEADREV2STRUCT, *[values[key] for key in BHEADREV2LIST]) + '\x00' * 68
+      except struct.error as e:
+        self._fp.close()
+        raise ValueError('Binary header value out of range: %s'%(e,))
+
+      self._fp.write(textheader)
+      self._fp.write(blockheader)
+
+  def write (self, headers, traces):
+    '''
+    Appends a block of traces to the file.  Raises ValueError, rather than
+    writing a wrapped value, if a header value does not fit its field.
+
+    :param headers: Trace headers for the block; a structured array (e.g., from :py:meth:`SEGYFile.readTraceHeaders`) or a dict of columns.  Fields that are not given are written as zero, except *ns*, which is filled in.
+    :type headers: ndarray, dict
+    :param traces: 2D array of traces, shape (ntraces, ns).
+    :type traces: ndarray
+    '''
+
+    traces = np.atleast_2d(traces)
+    ntraces = traces.shape[0]
+
+    if (traces.shape[1] != self.ns):
+      raise SEGYFileException('Expected %d samples per trace, got %d.'%(self.ns, traces.shape[1]))
+
+    if isinstance(headers, dict):
+      names = headers.keys()
+    else:
+      names = headers.dtype.names
+
+    trhead = np.zeros((ntraces,), dtype=self.trheaddtype)
+    for name in names:
+      if (name in self.trheaddtype.fields):
+        limits = _fieldOverflow(self.trheaddtype.fields[name][0], headers[name])
+        if (limits is not None):
+          raise ValueError('Values for %s must be in the range [%d, %d].'%(name, limits[0], limits[1]))
+        trhead[name] = headers[name]
+    if ('ns' not in names and 'ns' in self.trheaddtype.fields):
+      trhead['ns'] = self.ns if (self.ns <= 0xFFFF) else 0
+
+    records = np.empty((ntraces,), dtype=self.recdtype)
+    records['header'] = trhead.view('V240')
+
+    if (self.format == 1):
+      ieee2ibmBlock(traces, records['data'])
+    else:
+      records['data'] = traces
+
+    records.tofile(self._fp)
+    self.ntr += ntraces
+
+  def close (self):
+    '''
+    Flushes and closes the output file.
+    '''
+
+    if (not self._fp.closed):
+      self._fp.close()
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, exc_type, exc_value, traceback):
+    self.close()
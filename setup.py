@@ -60,7 +60,7 @@ extensions = [
     Extension(genName('fullpy'),    genPath(['fullpy.py'])),
     Extension(genName('rsfread'),   genPath(['rsfread.py'])),
     Extension(genName('segyarray'), genPath(['segyarray.py'])),
-    Extension(genName('segyread'),  genPath(['segyread.pyx', 'fpconvert.c'])),
+    Extension(genName('segyread'),  genPath(['segyread.pyx', 'fpconvert.c', 'fastcopy.c'])),
     Extension(genName('testing'),   genPath(['testing.py'])),
 ]
 
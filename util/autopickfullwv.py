@@ -36,7 +36,9 @@ nr = ini['nr']
 
 sf = SEGYFile(infile)
 dt = sf.bhead['hdt'] * TUNIT
-picks = (np.argmax(energyratio(sf[:], wlen), axis=1) + shift)
+picks = np.empty((sf.ntr,), dtype=np.int64)
+for index, traces in sf.iter_chunks():
+    picks[index] = np.argmax(energyratio(traces, wlen), axis=1) + shift
 picks.shape = (ns, nr)
 
 picks = picks * dt
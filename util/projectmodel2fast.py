@@ -144,9 +144,10 @@ if (scalel < 0):
 scalel = scalel / unit
 
 # Get the x,y,z coordinates for the top of each trace
-traceX = np.array([float(trh['sx'])*scalco for trh in sfgeom.trhead])
-traceY = np.array([float(trh['sy'])*scalco for trh in sfgeom.trhead])
-traceZ = np.array([float(trh['selev'])*scalel for trh in sfgeom.trhead])
+trhcols = sfgeom.readTraceHeaders(['sx', 'sy', 'selev'], asdict=True)
+traceX = trhcols['sx'].astype(np.float64)*scalco
+traceY = trhcols['sy'].astype(np.float64)*scalco
+traceZ = trhcols['selev'].astype(np.float64)*scalel
 
 # Some working arrays
 theones = np.ones((ntr,ns))
@@ -59,7 +59,8 @@ printnow('\tFound %d shot gathers.'%(ngathers,))
 # ------------------------------------------------------------------------
 # Read the receiver geometry and form two arrays containing the results
 printnow('Reading receiver geometry information...')
-geom = np.array([[trh['gx'],trh['gy']] for trh in sf.trhead], dtype=np.float32)/scalco
+trhcols = sf.readTraceHeaders(['gx', 'gy'], asdict=True)
+geom = np.array([trhcols['gx'], trhcols['gy']], dtype=np.float32).T/scalco
 x,y = geom.T
 cplgeom = x + 1j * y
 
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# pygeo - a distribution of tools for managing geophysical data
+# Copyright (C) 2011, 2012 Brendan Smithyman
+
+# This file is part of pygeo.
+
+# pygeo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+
+# pygeo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with pygeo.  If not, see <http://www.gnu.org/licenses/>.
+
+# ----------------------------------------------------------------------
+
+from optparse import OptionParser
+import os.path
+from pygeo.segyread import SEGYFile, MEGABYTE
+
+usage = 'usage: %prog [options] infile outfile key [key ...]'
+version = '\n%prog v1.0\nBrendan Smithyman'
+parser = OptionParser(usage=usage, version=version)
+parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
+                  help='display status information')
+parser.add_option('-s', '--su', action='store_true', dest='isSU',
+                  help='input is a Seismic Unix file')
+parser.add_option('-m', '--memory', type='int', dest='memory',
+                  help='memory to use for trace records, in MB [default: %default]')
+parser.set_defaults(verbose=False, isSU=False, memory=256)
+(options, args) = parser.parse_args()
+
+if (len(args) < 3):
+  parser.error('Please specify an input file, an output file and at least one header key.')
+elif (not os.path.isfile(args[0])):
+  parser.error('File %s does not exist!'%(args[0],))
+
+infile, outfile = args[:2]
+keys = args[2:]
+
+if (options.verbose):
+  print('\nSEG-Y/SU Trace Sorter v1.0\n\n\tSorting \'%s\' by %s into \'%s\'...\n'%(infile, ', '.join(keys), outfile))
+
+sf = SEGYFile(infile, verbose=options.verbose, isSU=options.isSU, lazy=True)
+sf.writeSorted(outfile, keys, max_bytes=options.memory*MEGABYTE)
+
+if (options.verbose):
+  print('Done!\n')
@@ -67,10 +67,8 @@
 import os
 import sys
 import numpy as np
-import mmap
-import struct
 import glob
-import warnings
+from pygeo.segyread import SEGYFile
 
 # Aliases
 ssw = sys.stdout.write
@@ -89,29 +87,8 @@ fastunit = 1000 # metres or ns
 # How close is close?
 threshold = 5 # metres
 
-# Mapping between headers and byte-offsets
-headers = {'shotid':8,'channel':12,'sx':72,'sy':76,'rx':80,'ry':84,'delay':108}
-
-# ----------------------------------------------------------------------
-# Internal constants / variables
-BHEADLIST = ['jobid','lino','reno','ntrpr','nart','hdt','dto','hns','nso',
-             'format','fold','tsort','vscode','hsfs','hsfe','hslen','hstyp',
-             'schn','hstas','hstae','htatyp','hcorr','bgrcv','rcvm','mfeet',
-             'polyt','vpol']
-
-TRHEADLIST = ['tracl','tracr','fldr','tracf','ep','cdp','cdpt','trid','nvs',
-             'nhs','duse','offset','gelev','selev','sdepth','gdel','sdel',
-             'swdep','gwdep','scalel','scalco','sx','sy','gx','gy','counit',
-             'wevel','swevel','sut','gut','sstat','gstat','tstat','laga',
-             'lagb','delrt','muts','mute','ns','dt','gain','igc','igi','corr',
-             'sfs','sfe','slen','styp','stas','stae','tatyp','afilf','afils',
-             'nofilf','nofils','lcf','hcf','lcs','hcs','year','day','hour','minute','sec',
-             'timbas','trwf','grnors','grnofr','grnlof','gaps','otrav']
-
-STRUCT_TRHEAD = '>7L4H8L2H4L46H'
-STRUCT_BHEAD = '>3L24H'
-
-progchars = ['-','\\','|','/']
+# Mapping between quantities and trace headers (SU names)
+headers = {'shotid':'fldr','channel':'tracf','sx':'sx','sy':'sy','rx':'gx','ry':'gy','delay':'delrt'}
 
 # ----------------------------------------------------------------------
 # Useful functions
@@ -122,111 +99,58 @@ def fastgetshotxy (pickfile):
   f.close()
   return [float(item)*fastunit for item in line.strip().split()[:2]] #x,y
 
-def ssc ():
-  sys.stdout.write('                                                                       \r')
-  ssf()
-
-def progress ():
-  if (progress.count > 3):
-    progress.count = 0
-  ssw('%s\r'%(progchars[progress.count],))
-  ssf()
-  progress.count += 1
-progress.count = 0
-
 # ----------------------------------------------------------------------
 # Main program
 
 print('\nSEG-Y/FAST Pick Importer\nBrendan Smithyman\nbsmithyman@eos.ubc.ca\nMarch, 2011\n')
 
-filesize = os.path.getsize(sgfile)
-
 ssw('  Mapping SEG-Y file... ')
-f = open(sgfile, 'r+b')
-sgmap = mmap.mmap(f.fileno(),0,mmap.MAP_SHARED)
-f.close()
+sf = SEGYFile(sgfile, endian='Big', writable=insertheaders)
 ssw('Done.\r*\n')
 
-if (filesize != sgmap.size()):
-  ssw('ERROR: Failed to map entire file.\n')
-
 ssw('  Scanning SEG-Y file and determining parameters... ')
-# Decode EBCDIC reel header
-textheader = sgmap[:3200].decode('IBM500')
-
-# Decode and unpack binary header
-tbh = struct.unpack(STRUCT_BHEAD, sgmap[3200:3260])
-bhead = {}
-for i, label in enumerate(BHEADLIST):
-  bhead[label] = tbh[i]
+ns = sf.ns
 
-ns = bhead['hns']
-
-if (ns != struct.unpack('>H',sgmap[3600+114:3600+116])[0]):
+if (ns != sf.trhead[0]['ns']):
   print('ERROR: Number of samples in first trace header conflicts with\n       binary header.')
   exit()
 
-if ((filesize-3600)%(240+ns*4) != 0):
+if ((sf.filesize-3600)%(240+ns*sf.samplen) != 0):
   print('ERROR: File length mismatch.\n       Likely that file is corrupt or has variable-length traces.')
   exit()
 
-ntr = (sgmap.size()-3600)/(240+ns*4)
-
-def calcoffset (trace):
-  return 3600 + (240+ns*4)*trace
+trh = sf.readTraceHeaders([headers[key] for key in ['shotid','channel','sx','sy','rx','ry']], asdict=True)
 
-coordscale = struct.unpack('>h',sgmap[3670:3672])[0]
+coordscale = sf.trhead[0]['scalco']
 if (coordscale < 0):
   coordscale = 1./abs(coordscale)
 
 ssw('Done.\r*\n')
 
-# Compile an array of all shotids
-shotoff = headers['shotid']
-chanoff = headers['channel']
-shotids = []
-chanids = []
-ssw('  Reading SHOTID and CHANNEL headers... \r')
-ssf()
-for trace in xrange(ntr):
-  off = calcoffset(trace)
-  shotids.append(struct.unpack('>L',sgmap[off+shotoff:off+shotoff+4])[0])
-  chanids.append(struct.unpack('>L',sgmap[off+chanoff:off+chanoff+4])[0])
-  progress()
-
-ssw('\r* Reading SHOTID and CHANNEL headers... Done.\n')
-
-shotids = np.array(shotids)
-chanids = np.array(chanids)
+shotids = trh[headers['shotid']]
+chanids = trh[headers['channel']]
 
-ssw('  Finding unique SHOTIDs... ')
+ssw('  Indexing SHOTIDs... ')
 ssf()
+# Sorted index, used to look up the traces in each shot gather
+shotindex = sf.sortedIndex([headers['shotid']])
+
 # Find all unique shot ids and an occurence
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    [usids, usidlocs] = np.unique(shotids,return_index=True)
+[usids, usidlocs] = np.unique(shotids,return_index=True)
 usidorder = np.argsort(usidlocs)
 usids = usids[usidorder]
 usidlocs = usidlocs[usidorder]
 ssw('Done.\r*\n')
 
-sxo = headers['sx']
+shotlocations = np.column_stack((trh[headers['sx']][usidlocs], trh[headers['sy']][usidlocs])) * coordscale
 
-ssw('  Reading coordinates for each unique SHOTID... ')
-ssf()
-shotlocations = np.array([[item*coordscale for item in struct.unpack('>2L',sgmap[calcoffset(loc)+sxo:calcoffset(loc)+sxo+8])] for loc in usidlocs])
-ssw('Done.\r*\n')
- 
-rxo = headers['rx']
-
-ssw('  Reading coordinates for each CHANNEL by SHOTID gather... \r')
+ssw('  Reading coordinates for each CHANNEL by SHOTID gather... ')
 ssf()
 tracedata = []
 for sid in usids:
-  traces = np.argwhere(shotids == sid)
-  tracedata.append(np.array([[loc]+[item*coordscale for item in struct.unpack('>2L',sgmap[calcoffset(loc)+rxo:calcoffset(loc)+rxo+8])] for loc in traces.reshape((len(traces),))]))
-  progress()
-ssw('* Reading coordinates for each CHANNEL by SHOTID gather... Done.\n')
+  traces = shotindex.lookup(sid)
+  tracedata.append(np.column_stack((traces, trh[headers['rx']][traces]*coordscale, trh[headers['ry']][traces]*coordscale)))
+ssw('Done.\r*\n')
 
 # Scan all the matching pick files
 ssw('  Reading shot coordinates from FAST files...')
@@ -237,33 +161,40 @@ fastorder = np.argsort(fastfiles)
 ssw('Done.\r*\n')
 
 outlines = ['SHOTID\tCHANNEL\tTime\n']
-fastcorresponds = []
+picktraces = []
+picktimes = []
 for index in fastorder:
   fsx,fsy = fastshotinfo[index]
-  shotidloc = np.argwhere((np.abs(shotlocations[:,0]-fsx) < threshold) * (np.abs(shotlocations[:,1]-fsy) < threshold))
-  fastcorresponds.append(shotidloc)
+  shotidloc = np.flatnonzero((np.abs(shotlocations[:,0]-fsx) < threshold) * (np.abs(shotlocations[:,1]-fsy) < threshold))
+  if (len(shotidloc) == 0):
+    ssw('\r  No SHOTID corresponds to %r; skipping.\n'%(fastfiles[index],))
+    continue
+  shotidloc = shotidloc[0]
   ssw('\r  Processing %r, which corresponds to SHOTID %d'%(fastfiles[index],usids[shotidloc]))
   ssf()
   f = open(fastfiles[index], 'r')
   lines = f.readlines()
   f.close()
 
-  pickinfo = np.array([[float(item)*fastunit for item in line.strip().split()[:4]] for line in lines[1:]])
-  for frx,fry,frz,ptime in pickinfo:
-    lokey = np.argwhere((np.abs(tracedata[shotidloc][:,1].reshape((tracedata[shotidloc].shape[0],))-frx) < threshold) * (np.abs(tracedata[shotidloc][:,2].reshape((tracedata[shotidloc].shape[0],))-fry) < threshold))
-    if (lokey):
-      trace = int(tracedata[shotidloc][lokey,0][0,0])
-      outlines.append('%d\t%d\t%f\n'%(shotids[trace],chanids[trace],ptime))
-      if (insertheaders):
-        delayloc = calcoffset(trace) + headers['delay']
-        sgmap[delayloc:delayloc+2] = struct.pack('>H',int(ptime))
+  pickinfo = np.array([[float(item)*fastunit for item in line.strip().split()[:4]] for line in lines[1:]]).reshape((-1,4))
+
+  # Match every pick to the receivers in the gather at once
+  gather = tracedata[shotidloc]
+  near = (np.abs(gather[:,1][np.newaxis,:] - pickinfo[:,0][:,np.newaxis]) < threshold) * (np.abs(gather[:,2][np.newaxis,:] - pickinfo[:,1][:,np.newaxis]) < threshold)
+  matched = near.any(axis=1)
+  traces = gather[near.argmax(axis=1)[matched],0].astype(np.int64)
+
+  for trace, ptime in zip(traces, pickinfo[matched,3]):
+    outlines.append('%d\t%d\t%f\n'%(shotids[trace],chanids[trace],ptime))
+  picktraces.append(traces)
+  picktimes.append(pickinfo[matched,3])
 
 ssw('\n  Processed picks...\n')
 ssf()
-if (insertheaders):
+if (insertheaders and picktraces):
+  sf.updateTraceHeaders(headers['delay'], np.concatenate(picktimes), np.concatenate(picktraces))
   ssw('(flushing buffers)...\n')
-  sgmap.flush()
-  sgmap.close()
+  sf.flush()
   ssw('                 ...and inserted them into the trace headers.\n')
 
 ssw('  Opening %s...\n'%(outfile,))
@@ -105,9 +105,10 @@ scalel = float(trh0['scalel'])
 if (scalel < 0):
   scalel = -1./scalel
 
-traceX = np.array([float(trh['sx'])*scalco for trh in sfgeom.trhead])
-traceY = np.array([float(trh['sy'])*scalco for trh in sfgeom.trhead])
-traceZ = np.array([float(trh['selev'])*scalel for trh in sfgeom.trhead])
+trhcols = sfgeom.readTraceHeaders(['sx', 'sy', 'selev'], asdict=True)
+traceX = trhcols['sx'].astype(np.float64)*scalco
+traceY = trhcols['sy'].astype(np.float64)*scalco
+traceZ = trhcols['selev'].astype(np.float64)*scalel
 
 theones = np.ones((ntr,ns))
 theslope = -np.arange(ns) * dz
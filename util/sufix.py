@@ -22,7 +22,7 @@
 
 from optparse import OptionParser
 import os.path
-from pygeo.segyread import SEGYFile
+from pygeo.segyread import SEGYFile, SEGYWriter
 
 usage = 'usage: %prog [options] infile [outfile]'
 version = '\n%prog v1.0\nBrendan Smithyman\nJuly, 2011'
@@ -50,17 +50,15 @@ if (options.verbose):
   print('\nSEG-Y --> SU File Converter v1.0\nBrendan Smithyman, July 2011\n\n\tConverting \'%s\' to \'%s\'...\n'%(infile, outfile))
 
 sf = SEGYFile(infile, verbose=options.verbose, majorheadersonly=False)
-intr = sf.readTraces()
-if (options.normalize):
-  intr = sf.sNormalize(intr)
 
 if (options.verbose):
   print('Generating output file.')
 
-if (len(intr.shape) == 1):
-    intr = [intr]
-
-sf.writeSU(outfile, intr, sf.trhead)
+with SEGYWriter(outfile, sf.ns, isSU=True, trheaddtype=sf.trheaddtype) as writer:
+  for index, intr in sf.iter_chunks():
+    if (options.normalize):
+      intr = sf.sNormalize(intr)
+    writer.write(sf.readTraceHeaders(traces=index), intr)
 
 if (options.verbose):
   print('Done!\n')
@@ -113,8 +113,9 @@ if (scalel < 0):
 
 coordarr = np.zeros((sntr,3), dtype=np.float32)
 
-coordarr[:,0] = np.array([float(trh['sx'])*scalco for trh in sfstack.trhead])
-coordarr[:,1] = np.array([float(trh['sy'])*scalco for trh in sfstack.trhead])
+trhcols = sfstack.readTraceHeaders(['sx', 'sy'], asdict=True)
+coordarr[:,0] = trhcols['sx']*scalco
+coordarr[:,1] = trhcols['sy']*scalco
 
 newcoordarr = reduceToLocal(coordarr, angle, basis)
 
@@ -1,3 +1,5 @@
+import matplotlib
+import matplotlib.pyplot as plt
 from pygeo.analysis import *
 from pygeo.segyread import SEGYFile
 